@@ -0,0 +1,541 @@
+"""
+Schema and connection helpers for cubestats.db.
+
+The schema is versioned with ``PRAGMA user_version``: the original tables
+are created first and every entry in ``MIGRATIONS`` then brings the file up
+to date, so old databases and new ones end up with the same layout.
+"""
+
+import hashlib
+import sqlite3
+
+from core.periods import range_condition
+from core.scramble import encode_scrambles
+from core.stats import (backfill_averages, rebuild_personal_bests,
+                        refresh_session_stats)
+
+
+DB_PATH = 'database/cubestats.db'
+
+
+def solve_fingerprint(timestamp, milliseconds, scramble):
+    """
+    Stable identifier of a solve, the same on every device that has it.
+
+    It is built from the timestamp (epoch seconds), the raw time in
+    milliseconds and the scramble, and fits in a signed 64 bit integer.
+    """
+    key = f'{int(timestamp)}|{int(milliseconds)}|{scramble or ""}'
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _create_base_tables(cursor):
+    'Creates the original tables used by the timer'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS solves (
+            Session TEXT,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Date TEXT,
+            Time REAL,
+            Penalty TEXT,
+            Mix TEXT,
+            avg5 REAL,
+            avg12 REAL,
+            avg100 REAL,
+            avg1000 REAL,
+            avg5000 REAL,
+            avg10000 REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            name TEXT PRIMARY KEY
+        )
+    ''')
+
+
+def _column_names(cursor, table):
+    'Returns the column names of a table'
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+
+
+def _migrate_session_overview(cursor):
+    """
+    Adds the cube type of every solve, fills the stored averages and adds
+    the covering index used by core.stats.session_overview.
+    """
+    if 'Cube' not in _column_names(cursor, 'solves'):
+        cursor.execute('ALTER TABLE solves ADD COLUMN Cube TEXT')
+    backfill_averages(cursor.connection)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_solves_overview
+        ON solves(Session, Cube, Time, Date, avg5, avg12)
+    ''')
+
+
+def _migrate_penalties(cursor):
+    """
+    Moves the penalties out of the Time column.
+
+    Older versions wrote the string 'DNF' over the time of DNF solves, they
+    get the csTimer DNF penalty instead (their raw time is lost). Time is
+    the raw time from now on and the overview index covers the penalty.
+    """
+    cursor.execute("UPDATE solves SET Penalty = -1, Time = NULL "
+                   "WHERE typeof(Time) = 'text'")
+    cursor.execute("UPDATE solves SET Penalty = 0 "
+                   "WHERE Penalty IS NULL OR Penalty = ''")
+    cursor.execute('DROP INDEX IF EXISTS idx_solves_overview')
+    cursor.execute('''
+        CREATE INDEX idx_solves_overview
+        ON solves(Session, Cube, Time, Penalty, Date, avg5, avg12)
+    ''')
+
+
+def _migrate_fingerprints(cursor, batch_size=10000):
+    'Adds the indexed fingerprint used to skip duplicates when importing'
+    if 'Fingerprint' not in _column_names(cursor, 'solves'):
+        cursor.execute('ALTER TABLE solves ADD COLUMN Fingerprint INTEGER')
+    read = cursor.connection.cursor()
+    read.execute("SELECT id, strftime('%s', Date, 'utc'), Time, Mix "
+                 "FROM solves WHERE Fingerprint IS NULL")
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        cursor.executemany(
+            'UPDATE solves SET Fingerprint = ? WHERE id = ?',
+            [(solve_fingerprint(timestamp or 0, round((time or 0) * 1000), mix),
+              solve_id) for solve_id, timestamp, time, mix in rows])
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_solves_fingerprint '
+                   'ON solves(Fingerprint)')
+
+
+def _migrate_epoch_dates(cursor, batch_size=50000):
+    """
+    Stores dates as epoch milliseconds instead of 'yyyy-MM-dd HH:mm:ss' text.
+
+    The Date column has TEXT affinity, so the table is rebuilt with an
+    INTEGER column. Rows are copied in batches of ids, each one in its own
+    transaction, and an interrupted copy resumes where it stopped.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS solves_epoch (
+            Session TEXT,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Date INTEGER,
+            Time REAL,
+            Penalty TEXT,
+            Mix TEXT,
+            avg5 REAL,
+            avg12 REAL,
+            avg100 REAL,
+            avg1000 REAL,
+            avg5000 REAL,
+            avg10000 REAL,
+            Cube TEXT,
+            Fingerprint INTEGER
+        )
+    ''')
+    copied = cursor.execute(
+        'SELECT COALESCE(MAX(id), 0) FROM solves_epoch').fetchone()[0]
+    last = cursor.execute(
+        'SELECT COALESCE(MAX(id), 0) FROM solves').fetchone()[0]
+    while copied < last:
+        cursor.execute('''
+            INSERT INTO solves_epoch
+            SELECT Session, id,
+                   CAST(strftime('%s', Date, 'utc') AS INTEGER) * 1000,
+                   Time, Penalty, Mix, avg5, avg12, avg100, avg1000, avg5000,
+                   avg10000, Cube, Fingerprint
+            FROM solves WHERE id > ? AND id <= ?
+        ''', (copied, copied + batch_size))
+        cursor.connection.commit()
+        copied += batch_size
+
+    cursor.execute('DROP TABLE solves')
+    cursor.execute('ALTER TABLE solves_epoch RENAME TO solves')
+    cursor.execute('''
+        CREATE INDEX idx_solves_overview
+        ON solves(Session, Cube, Time, Penalty, Date, avg5, avg12)
+    ''')
+    cursor.execute('CREATE INDEX idx_solves_fingerprint ON solves(Fingerprint)')
+    cursor.execute('CREATE INDEX idx_solves_session_date '
+                   'ON solves(Session, Date)')
+
+
+def _migrate_session_index(cursor):
+    """
+    Indexes the solves of a session in id order (the rowid ends every
+    index), so the rolling averages after a change and the session loader
+    read a range of ids instead of sorting the whole session.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_solves_session '
+                   'ON solves(Session)')
+
+
+def _migrate_change_log(cursor):
+    """
+    Adds the append-only log of changes replicated by core.sync.
+
+    Triggers record every insert, penalty change, move to another session
+    and removal of a solve, identified by its fingerprint. The solves that
+    already exist are logged as inserts, so a new device receives them on
+    its first sync. sync_state keeps the cursors of every peer.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            Op TEXT,
+            Fingerprint INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            peer TEXT PRIMARY KEY,
+            pulled INTEGER NOT NULL DEFAULT 0,
+            pushed INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT INTO changes (Op, Fingerprint) "
+                   "SELECT 'insert', Fingerprint FROM solves ORDER BY id")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_insert AFTER INSERT ON solves
+        BEGIN
+            INSERT INTO changes (Op, Fingerprint)
+            VALUES ('insert', NEW.Fingerprint);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_penalty AFTER UPDATE OF Penalty
+        ON solves WHEN NEW.Penalty IS NOT OLD.Penalty
+        BEGIN
+            INSERT INTO changes (Op, Fingerprint)
+            VALUES ('penalty', NEW.Fingerprint);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_session AFTER UPDATE OF Session
+        ON solves WHEN NEW.Session IS NOT OLD.Session
+        BEGIN
+            INSERT INTO changes (Op, Fingerprint)
+            VALUES ('session', NEW.Fingerprint);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_delete AFTER DELETE ON solves
+        BEGIN
+            INSERT INTO changes (Op, Fingerprint)
+            VALUES ('delete', OLD.Fingerprint);
+        END
+    ''')
+
+
+def _migrate_packed_scrambles(cursor, batch_size=50000):
+    """
+    Packs the scrambles stored as text (see core.scramble), in batches of
+    ids that are committed one by one. The space freed in the file is
+    reused by new solves, VACUUM gives it back.
+    """
+    packed = 0
+    last = cursor.execute(
+        'SELECT COALESCE(MAX(id), 0) FROM solves').fetchone()[0]
+    while packed < last:
+        rows = cursor.execute(
+            "SELECT id, Mix FROM solves WHERE id > ? AND id <= ? "
+            "AND typeof(Mix) = 'text'", (packed, packed + batch_size)).fetchall()
+        mixes = encode_scrambles([mix for _, mix in rows])
+        cursor.executemany(
+            'UPDATE solves SET Mix = ? WHERE id = ?',
+            [(mix, solve_id) for (solve_id, _), mix in zip(rows, mixes)
+             if isinstance(mix, bytes)])
+        cursor.connection.commit()
+        packed += batch_size
+
+
+def _migrate_personal_bests(cursor):
+    'Adds the leaderboards of personal bests (see core.stats) of every session'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS personal_bests (
+            Session TEXT,
+            Size INTEGER,
+            EndId INTEGER,
+            StartId INTEGER,
+            Result REAL,
+            PRIMARY KEY (Session, Size, EndId)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_personal_bests_result
+        ON personal_bests(Session, Size, Result)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS personal_best_boards (
+            Session TEXT,
+            Size INTEGER,
+            Cutoff REAL,
+            PRIMARY KEY (Session, Size)
+        )
+    ''')
+    sessions = [name for (name,) in cursor.execute(
+        'SELECT DISTINCT Session FROM solves')]
+    for name in sessions:
+        rebuild_personal_bests(cursor.connection, name)
+
+
+def _migrate_session_order(cursor):
+    """
+    Recomputes the averages and personal bests of the sessions where older
+    solves were merged after newer ones, which were computed in id order:
+    core.stats reads the solves of a session in (Date, id) order.
+    """
+    sessions = [name for (name,) in cursor.execute('''
+        SELECT DISTINCT Session
+        FROM (SELECT Session, id,
+                     LAG(id) OVER (PARTITION BY Session ORDER BY Date, id)
+                         AS previous
+              FROM solves)
+        WHERE previous > id
+    ''')]
+    for name in sessions:
+        backfill_averages(cursor.connection, name)
+        rebuild_personal_bests(cursor.connection, name)
+    refresh_session_stats(cursor.connection, sessions)
+
+
+def _migrate_session_ranges(cursor):
+    """
+    Makes the (Session, Date) index cover the statistics, so that the
+    solves of a range of dates are read session by session without
+    scanning the whole table. It also serves the grouped statistics of a
+    session, so the overview index goes.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_solves_overview')
+    cursor.execute('DROP INDEX IF EXISTS idx_solves_session_date')
+    cursor.execute('''
+        CREATE INDEX idx_solves_session_date
+        ON solves(Session, Date, Cube, Time, Penalty, avg5, avg12)
+    ''')
+
+
+def _migrate_change_origins(cursor):
+    """
+    Records where every logged change comes from: NULL when it was made on
+    this device, otherwise the peer it was received from. The changes
+    pulled from a server stay in the log and are not pushed back to it.
+    """
+    if 'Origin' not in _column_names(cursor, 'changes'):
+        cursor.execute('ALTER TABLE changes ADD COLUMN Origin TEXT')
+
+
+def _migrate_date_order(cursor):
+    """
+    Puts the id after the date in the (Session, Date) index, so that the
+    solves of a session are read in (Date, id) order without sorting the
+    ones that share a date. The (Session) index read them in id order and
+    goes.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_solves_session_date')
+    cursor.execute('''
+        CREATE INDEX idx_solves_session_date
+        ON solves(Session, Date, id, Cube, Time, Penalty, avg5, avg12)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_solves_session')
+
+
+def _result(row):
+    'Time of the NEW or OLD solve of a trigger with its penalty, NULL for DNF'
+    return (f'CASE CAST({row}.Penalty AS INTEGER) WHEN -1 THEN NULL '
+            f'WHEN 2000 THEN {row}.Time + 2 ELSE {row}.Time END')
+
+
+def _least(column, value):
+    'Smallest of a column and a value, ignoring NULL'
+    return (f'CASE WHEN {column} IS NULL OR {value} < {column} '
+            f'THEN {value} ELSE {column} END')
+
+
+def _add_solve(row):
+    'Statement adding the NEW or OLD solve of a trigger to session_stats'
+    return f'''
+        INSERT INTO session_stats (Session, Cube, Solves, Valid, Total, Best,
+                                   DateStart, DateEnd, BestAvg5, BestAvg12)
+        SELECT {row}.Session, COALESCE({row}.Cube, ''), 1,
+               result IS NOT NULL, COALESCE(result, 0), result, {row}.Date,
+               {row}.Date, {row}.avg5, {row}.avg12
+        FROM (SELECT {_result(row)} AS result) WHERE true
+        ON CONFLICT (Session, Cube) DO UPDATE SET
+            Solves = Solves + 1,
+            Valid = Valid + excluded.Valid,
+            Total = Total + excluded.Total,
+            Best = {_least('Best', 'excluded.Best')},
+            DateStart = {_least('DateStart', 'excluded.DateStart')},
+            DateEnd = CASE WHEN DateEnd IS NULL OR excluded.DateEnd > DateEnd
+                      THEN excluded.DateEnd ELSE DateEnd END,
+            BestAvg5 = {_least('BestAvg5', 'excluded.BestAvg5')},
+            BestAvg12 = {_least('BestAvg12', 'excluded.BestAvg12')};
+    '''
+
+
+def _remove_solve(row):
+    """
+    Statements removing the NEW or OLD solve of a trigger from
+    session_stats. The first and last dates are found again with the
+    (Session, Date) index, the group is marked as stale when the solve held
+    one of its best results.
+    """
+    group = f"Session = {row}.Session AND Cube = COALESCE({row}.Cube, '')"
+    solves = f'FROM solves WHERE Session = {row}.Session AND Cube IS {row}.Cube'
+    return f'''
+        UPDATE session_stats SET
+            Solves = Solves - 1,
+            Valid = Valid - ({_result(row)} IS NOT NULL),
+            Total = Total - COALESCE({_result(row)}, 0),
+            Stale = Stale OR COALESCE({_result(row)} = Best
+                                      OR {row}.avg5 = BestAvg5
+                                      OR {row}.avg12 = BestAvg12, 0),
+            DateStart = CASE WHEN {row}.Date = DateStart
+                        THEN (SELECT Date {solves} ORDER BY Date LIMIT 1)
+                        ELSE DateStart END,
+            DateEnd = CASE WHEN {row}.Date = DateEnd
+                      THEN (SELECT Date {solves} ORDER BY Date DESC LIMIT 1)
+                      ELSE DateEnd END
+        WHERE {group};
+        DELETE FROM session_stats WHERE {group} AND Solves = 0;
+    '''
+
+
+def _migrate_session_stats(cursor):
+    """
+    Keeps the statistics of every (session, cube) group in session_stats,
+    so the overview of all the sessions reads a few rows instead of the
+    whole table.
+
+    Triggers add every new solve to its group. A removed or modified solve
+    is taken out of its group, and the groups where it held the best single
+    or average are marked as stale: core.stats recomputes them from the
+    covering index of their session (see refresh_session_stats).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_stats (
+            Session TEXT,
+            Cube TEXT,
+            Solves INTEGER,
+            Valid INTEGER,
+            Total REAL,
+            Best REAL,
+            DateStart INTEGER,
+            DateEnd INTEGER,
+            BestAvg5 REAL,
+            BestAvg12 REAL,
+            Stale INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (Session, Cube)
+        )
+    ''')
+    refresh_session_stats(cursor.connection, [
+        name for (name,) in cursor.execute('SELECT DISTINCT Session FROM solves')])
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_insert AFTER INSERT ON solves
+        BEGIN {_add_solve('NEW')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_delete AFTER DELETE ON solves
+        BEGIN {_remove_solve('OLD')} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_update
+        AFTER UPDATE OF Session, Cube, Time, Penalty, Date ON solves
+        WHEN OLD.Session IS NOT NEW.Session OR OLD.Cube IS NOT NEW.Cube
+             OR OLD.Time IS NOT NEW.Time OR OLD.Penalty IS NOT NEW.Penalty
+             OR OLD.Date IS NOT NEW.Date
+        BEGIN {_remove_solve('OLD')} {_add_solve('NEW')} END
+    ''')
+    # Averages are rewritten when the solves before them change
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_averages
+        AFTER UPDATE OF avg5, avg12 ON solves
+        WHEN OLD.avg5 IS NOT NEW.avg5 OR OLD.avg12 IS NOT NEW.avg12
+        BEGIN
+            UPDATE session_stats SET
+                Stale = Stale OR COALESCE(
+                    OLD.avg5 = BestAvg5 AND (NEW.avg5 IS NULL
+                                             OR NEW.avg5 > OLD.avg5), 0)
+                    OR COALESCE(OLD.avg12 = BestAvg12 AND (
+                        NEW.avg12 IS NULL OR NEW.avg12 > OLD.avg12), 0),
+                BestAvg5 = {_least('BestAvg5', 'NEW.avg5')},
+                BestAvg12 = {_least('BestAvg12', 'NEW.avg12')}
+            WHERE Session = NEW.Session AND Cube = COALESCE(NEW.Cube, '');
+        END
+    ''')
+
+
+MIGRATIONS = [
+    _migrate_session_overview,
+    _migrate_penalties,
+    _migrate_fingerprints,
+    _migrate_epoch_dates,
+    _migrate_session_index,
+    _migrate_change_log,
+    _migrate_packed_scrambles,
+    _migrate_personal_bests,
+    _migrate_session_stats,
+    _migrate_session_order,
+    _migrate_session_ranges,
+    _migrate_change_origins,
+    _migrate_date_order,
+]
+
+
+def migrate(connection):
+    'Applies the migrations that are newer than the database version'
+    cursor = connection.cursor()
+    _create_base_tables(cursor)
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        migration(cursor)
+        cursor.execute(f'PRAGMA user_version = {number}')
+        connection.commit()
+    connection.commit()
+
+
+def connect(path=DB_PATH, check_same_thread=True):
+    """
+    Opens the database and makes sure its schema is up to date.
+
+    The database uses write-ahead logging, so the sessions loaded in the
+    background do not block the solves being saved. With WAL, synchronous
+    NORMAL keeps the file consistent and only syncs at checkpoints.
+    """
+    connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    migrate(connection)
+    return connection
+
+
+def iter_solves(connection, columns, session=None, date_start=None,
+                date_end=None, order='Session, Date, id', batch_size=5000):
+    """
+    Yields the solves of the database in batches of rows.
+
+    Rows are read with fetchmany so that memory does not grow with the size
+    of the table. session, date_start and date_end (see range_condition)
+    filter the solves. A range of dates over every session is read session
+    by session, through the (Session, Date) index.
+    """
+    if session is None and (date_start, date_end) != (None, None):
+        sessions = [name for (name,) in connection.execute(
+            'SELECT DISTINCT Session FROM session_stats ORDER BY Session')]
+    else:
+        sessions = [session]
+    for name in sessions:
+        where, parameters = range_condition(name, date_start, date_end)
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT {', '.join(columns)} FROM solves {where} "
+                       f"ORDER BY {order}", parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
@@ -0,0 +1,121 @@
+"""
+Bulk modifications of solves.
+
+Every function changes any number of solves with set-based statements in a
+single transaction: the ids are staged in a temporary table, the solves are
+updated or deleted with one statement, and the stored averages and the
+personal bests of the affected sessions are repaired once at the end.
+"""
+
+from core.stats import (backfill_averages, refresh_session_stats,
+                        repair_personal_bests)
+
+
+def _stage_ids(cursor, ids):
+    'Puts the ids of the solves to modify in the temp.edit_ids table'
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS edit_ids '
+                   '(id INTEGER PRIMARY KEY)')
+    cursor.execute('DELETE FROM edit_ids')
+    cursor.executemany('INSERT OR IGNORE INTO edit_ids VALUES (?)',
+                       [(int(solve_id),) for solve_id in ids])
+
+
+def _affected_solves(cursor):
+    '(session, date, id) of the staged solves'
+    return cursor.execute('SELECT Session, Date, id FROM solves '
+                          'WHERE id IN (SELECT id FROM edit_ids)').fetchall()
+
+
+def _repair_statistics(connection, solves):
+    """
+    Recomputes the stored averages from the first modified solve of every
+    session, the personal bests around the modified solves and the session
+    statistics that the changes made stale
+    """
+    starts = {}
+    for session, date, solve_id in solves:
+        starts[session] = min(starts.get(session, (date, solve_id)),
+                              (date, solve_id))
+    for session, start in starts.items():
+        backfill_averages(connection, session, start=start)
+    repair_personal_bests(connection, solves)
+    refresh_session_stats(connection)
+
+
+def apply_penalty(connection, ids, penalty):
+    """
+    Sets the penalty of some solves, using the csTimer convention (0, 2000
+    for +2 or -1 for DNF). Returns the number of modified solves.
+    """
+    with connection:
+        cursor = connection.cursor()
+        _stage_ids(cursor, ids)
+        solves = _affected_solves(cursor)
+        cursor.execute('UPDATE solves SET Penalty = ? '
+                       'WHERE id IN (SELECT id FROM edit_ids)', (penalty,))
+        modified = cursor.rowcount
+        _repair_statistics(connection, solves)
+    return modified
+
+
+def delete_solves(connection, ids):
+    'Removes some solves, returns the number of removed solves'
+    with connection:
+        cursor = connection.cursor()
+        _stage_ids(cursor, ids)
+        solves = _affected_solves(cursor)
+        cursor.execute('DELETE FROM solves '
+                       'WHERE id IN (SELECT id FROM edit_ids)')
+        modified = cursor.rowcount
+        _repair_statistics(connection, solves)
+    return modified
+
+
+def move_solves(connection, ids, session):
+    """
+    Moves some solves to another session, which is created if needed. They
+    keep their ids and take their place in it by date. Returns the number
+    of moved solves.
+    """
+    with connection:
+        cursor = connection.cursor()
+        _stage_ids(cursor, ids)
+        solves = _affected_solves(cursor)
+        cursor.execute('INSERT OR IGNORE INTO sessions(name) VALUES (?)',
+                       (session,))
+        cursor.execute('UPDATE solves SET Session = ? '
+                       'WHERE id IN (SELECT id FROM edit_ids)', (session,))
+        modified = cursor.rowcount
+        moved = [(session, date, solve_id) for _, date, solve_id in solves]
+        _repair_statistics(connection, solves + moved)
+    return modified
+
+
+def parse_solve_numbers(text, count):
+    """
+    Converts a list of solve numbers and ranges such as '1-20, 25' to
+    sorted 0-based indices. Returns None when the text is not valid or a
+    number is not between 1 and count.
+    """
+    indices = set()
+    for part in text.replace(' ', '').split(','):
+        first, _, last = part.partition('-')
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        first, last = int(first), int(last or first)
+        if not 1 <= first <= last <= count:
+            return None
+        indices.update(range(first - 1, last))
+    return sorted(indices)
+
+
+def format_solve_numbers(indices):
+    'Converts sorted 0-based indices to solve numbers and ranges'
+    parts = []
+    for index in indices:
+        if parts and parts[-1][1] == index:
+            parts[-1][1] = index + 1
+        else:
+            parts.append([index + 1, index + 1])
+    return ', '.join(str(first) if first == last else f'{first}-{last}'
+                     for first, last in parts)
@@ -0,0 +1,54 @@
+"""
+Ranges of dates used to select solves.
+
+Dates are stored in the Date column as epoch milliseconds, so a period is a
+(start, end) pair of epoch milliseconds, None for an unbounded end.
+"""
+
+from datetime import datetime, timedelta
+
+
+def epoch_ms(date):
+    'Converts a datetime to epoch milliseconds, as stored in the Date column'
+    return int(date.timestamp() * 1000)
+
+
+def period_range(period, now=None):
+    """
+    Returns the (start, end) epoch milliseconds of a named period ending
+    now: 'all', 'today', 'week' (last 7 days), 'month' or 'year' (the
+    current calendar month or year). None means unbounded.
+    """
+    now = now or datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    starts = {
+        'all': None,
+        'today': midnight,
+        'week': midnight - timedelta(days=6),
+        'month': midnight.replace(day=1),
+        'year': midnight.replace(month=1, day=1),
+    }
+    start = starts[period]
+    return (epoch_ms(start) if start is not None else None), None
+
+
+def range_condition(session=None, date_start=None, date_end=None):
+    """
+    Builds the WHERE clause and parameters that select the solves of a
+    session in a range of epoch milliseconds (both ends inclusive, None
+    for unbounded). Range queries use the (Session, Date) index, ranges
+    over every session are read one session at a time.
+    """
+    conditions = []
+    parameters = []
+    if session is not None:
+        conditions.append('Session = ?')
+        parameters.append(session)
+    if date_start is not None:
+        conditions.append('Date >= ?')
+        parameters.append(date_start)
+    if date_end is not None:
+        conditions.append('Date <= ?')
+        parameters.append(date_end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, parameters
@@ -0,0 +1,105 @@
+"""
+Packed storage of scrambles in the Mix column.
+
+Scrambles made of the 18 face turns of a cube (R, L, U, D, F, B with no
+modifier, ' or 2) are stored as a BLOB: one byte with the number of moves
+followed by little endian uint16 values holding three moves each (18 ** 3
+fits in 16 bits), 15 bytes for a 20 move scramble instead of about 50
+characters. Any other scramble (other puzzles, unusual spacing) is kept as
+text, so decoding gives back exactly the scramble that was stored.
+
+The functions working on lists pack and unpack whole batches with numpy.
+"""
+
+import numpy as np
+
+
+FACES = ['R', 'L', 'U', 'D', 'F', 'B']
+MODIFIERS = ['', "'", '2']
+MOVES = [face + modifier for face in FACES for modifier in MODIFIERS]
+
+_MOVE_INDEX = {move: index for index, move in enumerate(MOVES)}
+_BASE = len(MOVES)
+_MAX_MOVES = 255
+
+# Text of every uint16 value, by the number of moves it holds (the last
+# value of a scramble may hold less than three)
+_names = np.array(MOVES, dtype=object)
+_codes = np.arange(_BASE ** 3)
+_first = _names[_codes // (_BASE * _BASE)]
+_second = _first + ' ' + _names[_codes // _BASE % _BASE]
+_GROUP_TEXT = {1: _first, 2: _second,
+               3: _second + ' ' + _names[_codes % _BASE]}
+
+
+def _move_indices(text):
+    'Indices of the moves of a scramble, None when it can not be packed'
+    if not isinstance(text, str):
+        return None
+    moves = text.split(' ')
+    if not text or len(moves) > _MAX_MOVES:
+        return None
+    indices = list(map(_MOVE_INDEX.get, moves))
+    return None if None in indices else indices
+
+
+def encode_scrambles(texts):
+    """
+    Packs a list of scrambles. Returns a list with the packed bytes of the
+    scrambles that can be packed and the other values unchanged.
+    """
+    result = list(texts)
+    groups = {}
+    for position, text in enumerate(result):
+        indices = _move_indices(text)
+        if indices is not None:
+            groups.setdefault(len(indices), []).append((position, indices))
+
+    for count, items in groups.items():
+        moves = np.zeros((len(items), -(-count // 3) * 3), dtype=np.uint16)
+        moves[:, :count] = [indices for _, indices in items]
+        moves = moves.reshape(len(items), -1, 3)
+        codes = (moves[..., 0] * _BASE + moves[..., 1]) * _BASE + moves[..., 2]
+        rows = np.empty((len(items), 1 + codes.shape[1] * 2), dtype=np.uint8)
+        rows[:, 0] = count
+        rows[:, 1:] = codes.astype('<u2').view(np.uint8)
+        for (position, _), row in zip(items, rows):
+            result[position] = row.tobytes()
+    return result
+
+
+def decode_scrambles(values):
+    """
+    Unpacks a list of values of the Mix column, packed scrambles become
+    text and the other values are returned unchanged.
+    """
+    result = list(values)
+    groups = {}
+    for position, value in enumerate(result):
+        if isinstance(value, bytes) and value:
+            groups.setdefault((len(value), value[0]), []).append(position)
+
+    for (size, count), positions in groups.items():
+        rows = np.frombuffer(b''.join(result[position] for position in positions),
+                             dtype=np.uint8).reshape(len(positions), size)
+        codes = np.ascontiguousarray(rows[:, 1:]).view('<u2')
+        full, rest = divmod(count, 3)
+        parts = [_GROUP_TEXT[3][codes[:, column]] for column in range(full)]
+        if rest:
+            parts.append(_GROUP_TEXT[rest][codes[:, full]])
+        texts = parts[0]
+        for part in parts[1:]:
+            texts = texts + ' ' + part
+        for position, text in zip(positions, texts.tolist()):
+            result[position] = text
+    return result
+
+
+def encode_scramble(text):
+    'Packs a single scramble, see encode_scrambles'
+    return encode_scrambles([text])[0]
+
+
+def decode_scramble(value):
+    'Unpacks a single value of the Mix column, see decode_scrambles'
+    return decode_scrambles([value])[0]
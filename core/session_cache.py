@@ -0,0 +1,76 @@
+"""
+Least recently used cache of the sessions loaded by the timer.
+
+Going back to a session that was recently shown restores its solves and
+its table model from memory instead of querying the database again and
+rebuilding the table. The cache is bounded by the total number of solves
+it holds.
+"""
+
+from collections import OrderedDict
+
+
+class SessionData(object):
+    'Solves of a loaded session and the table model that shows them'
+
+    def __init__(self, store, model):
+        self.store = store
+        self.model = model
+
+
+    def __len__(self):
+        return len(self.store)
+
+
+class SessionCache(object):
+    'Sessions kept in memory, the least recently used ones are evicted'
+
+    def __init__(self, max_solves):
+        self.max_solves = max_solves
+        self.entries = OrderedDict()
+        self.solves = 0
+
+
+    def take(self, session):
+        """
+        Removes a session from the cache and returns it, or None.
+
+        The session being shown is kept outside the cache, so its data can
+        be modified freely and is put back when another one is loaded.
+        """
+        data = self.entries.pop(session, None)
+        if data is not None:
+            self.solves -= len(data)
+        return data
+
+
+    def put(self, session, data):
+        'Stores a session as the most recently used one'
+        self.take(session)
+        self.entries[session] = data
+        self.solves += len(data)
+        self.evict()
+
+
+    def invalidate(self, session):
+        'Forgets a session whose solves changed in the database'
+        self.take(session)
+
+
+    def clear(self):
+        'Forgets every session, after another process changed the database'
+        self.entries.clear()
+        self.solves = 0
+
+
+    def resize(self, max_solves):
+        'Changes the maximum number of cached solves'
+        self.max_solves = max_solves
+        self.evict()
+
+
+    def evict(self):
+        'Removes the least recently used sessions until the cache fits'
+        while self.entries and self.solves > self.max_solves:
+            _, data = self.entries.popitem(last=False)
+            self.solves -= len(data)
@@ -0,0 +1,55 @@
+"""
+Background loading of the solves of a session.
+
+The rows are read by a QThread with its own database connection and sent to
+the GUI thread in chunks, so the window (and the timer) stays responsive
+while a large session is loading.
+"""
+
+import sqlite3
+
+from PyQt6.QtCore import QSemaphore, QThread, pyqtSignal
+
+from core.database import iter_solves
+
+
+class SessionLoader(QThread):
+    'Reads the solves of a session and emits them in chunks'
+
+    # Rows of (id, Time, Date, Penalty)
+    chunk_loaded = pyqtSignal(list)
+    loading_finished = pyqtSignal()
+
+    columns = ['id', 'Time', 'Date', 'Penalty']
+
+    def __init__(self, db_path, session, chunk_size=1000, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.session = session
+        self.chunk_size = chunk_size
+        # Released by the GUI thread once it has shown a chunk, so chunks
+        # never pile up in its event queue
+        self.chunk_shown = QSemaphore(1)
+
+
+    def wait_chunk_shown(self):
+        'Waits until the previous chunk is shown, False when interrupted'
+        while not self.chunk_shown.tryAcquire(1, 50):
+            if self.isInterruptionRequested():
+                return False
+        return True
+
+
+    def run(self):
+        'Streams the rows, stops early when an interruption is requested'
+        connection = sqlite3.connect(self.db_path)
+        try:
+            for rows in iter_solves(connection, self.columns, self.session,
+                                    order='Date, id', batch_size=self.chunk_size):
+                if not self.wait_chunk_shown():
+                    return
+                self.chunk_loaded.emit(rows)
+            if not self.isInterruptionRequested():
+                self.loading_finished.emit()
+        finally:
+            connection.close()
@@ -0,0 +1,143 @@
+"""
+Compact in-memory storage of the solves of a session.
+
+Solves are kept in parallel typed arrays (ids, raw times, dates as epoch
+milliseconds and a penalty bitmask) instead of a list of boxed Python
+objects, which takes 25 bytes per solve. Statistics are computed with
+NumPy on views of those buffers.
+
+In the database the penalty is stored in the Penalty column with the
+csTimer convention (0, 2000 for +2, -1 for DNF) and Time is the raw time.
+"""
+
+import re
+from array import array
+
+import numpy as np
+
+
+PENALTY_OK = 0
+PENALTY_PLUS2 = 1
+PENALTY_DNF = 2
+
+_CSTIMER_PENALTIES = {PENALTY_OK: 0, PENALTY_PLUS2: 2000, PENALTY_DNF: -1}
+
+# csTimer scramble types of the cubes of the timer, 333 is the default one
+_CSTIMER_CUBES = {'1x1': '111', '2x2': '222so', '3x3': '333',
+                  '4x4': '444wca', '5x5': '555wca', '6x6': '666wca'}
+
+
+def penalty_from_cstimer(value):
+    'Converts a csTimer penalty (as stored in the Penalty column) to flags'
+    value = int(value) if value not in (None, '') else 0
+    if value < 0:
+        return PENALTY_DNF
+    return PENALTY_PLUS2 if value > 0 else PENALTY_OK
+
+
+def penalty_to_cstimer(penalty):
+    'Converts penalty flags to the csTimer convention'
+    if penalty & PENALTY_DNF:
+        return _CSTIMER_PENALTIES[PENALTY_DNF]
+    return _CSTIMER_PENALTIES[penalty & PENALTY_PLUS2]
+
+
+def cube_from_cstimer(scramble_type):
+    """
+    Converts the scramble type of a csTimer session (its opt.scrType) to a
+    cube type of the timer, such as '3x3'. The variants of an NxN cube
+    (333oh, 444m...) are that cube, other puzzles keep the csTimer name.
+    """
+    scramble_type = scramble_type or '333'
+    match = re.match(r'(\d)\1\1', scramble_type)
+    return f'{match[1]}x{match[1]}' if match else scramble_type
+
+
+def cube_to_cstimer(cube):
+    'Converts a cube type of the timer to a csTimer scramble type, or None'
+    return _CSTIMER_CUBES.get(cube)
+
+
+def effective_time(time, penalty):
+    'Time of a solve once its penalty is applied, DNF solves are infinite'
+    if penalty & PENALTY_DNF or time is None:
+        return float('inf')
+    return time + 2 if penalty & PENALTY_PLUS2 else time
+
+
+def format_time(time, penalty):
+    'Text shown for a solve'
+    if penalty & PENALTY_DNF:
+        return 'DNF'
+    if penalty & PENALTY_PLUS2:
+        return f'{time + 2:.3f}+'
+    return f'{time:.3f}'
+
+
+class SolveStore(object):
+    'Solves of a session in typed arrays'
+
+    def __init__(self):
+        self.ids = array('q')
+        self.times = array('d')
+        self.dates = array('q')
+        self.penalties = array('B')
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def append(self, solve_id, time, date, penalty=PENALTY_OK):
+        'Adds a solve, time is the raw time and date epoch milliseconds'
+        self.ids.append(solve_id)
+        self.times.append(time if time is not None else float('nan'))
+        self.dates.append(date)
+        self.penalties.append(penalty)
+
+
+    def extend(self, rows):
+        'Adds (id, raw time, date, Penalty column value) rows'
+        for solve_id, time, date, penalty in rows:
+            self.append(solve_id, time, date, penalty_from_cstimer(penalty))
+
+
+    def pop(self, index=-1):
+        'Removes a solve'
+        self.ids.pop(index)
+        self.times.pop(index)
+        self.dates.pop(index)
+        self.penalties.pop(index)
+
+
+    def set_penalty(self, index, penalty):
+        'Changes the penalty of a solve'
+        self.penalties[index] = penalty
+
+
+    def effective_times(self, start=0):
+        """
+        Times with their penalties applied, DNF solves are infinite.
+
+        Only the solves from start on are converted, so the last ones can be
+        read without touching the whole session.
+        """
+        times = np.frombuffer(self.times, dtype=np.float64)[start:]
+        penalties = np.frombuffer(self.penalties, dtype=np.uint8)[start:]
+        effective = times + 2 * (penalties & PENALTY_PLUS2)
+        effective[(penalties & PENALTY_DNF) != 0] = np.inf
+        return effective
+
+
+    def best(self):
+        'Fastest solve, infinite when there are no valid solves'
+        if not len(self):
+            return float('inf')
+        return float(self.effective_times().min())
+
+
+    def mean(self):
+        'Mean of the valid solves, infinite when there are none'
+        times = self.effective_times()
+        times = times[np.isfinite(times)]
+        return float(times.mean()) if times.size else float('inf')
@@ -0,0 +1,45 @@
+"""
+Timing of the start up of the timer.
+
+Stages are marked as they are reached, relative to the moment the profile
+was created (as early as possible in main.py), and the report lists the
+time of each stage and the time spent since the previous one.
+"""
+
+import time
+
+
+class StartupProfile(object):
+    'Times of the stages of the start up'
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+
+
+    def mark(self, stage):
+        'Records the time of a stage, only the first time it is reached'
+        if stage not in self.stages:
+            self.marks.append((stage, time.perf_counter() - self.start))
+
+
+    @property
+    def stages(self):
+        return [stage for stage, _ in self.marks]
+
+
+    @property
+    def total(self):
+        'Time until the last stage'
+        return self.marks[-1][1] if self.marks else 0.0
+
+
+    def report(self):
+        'Returns the table of stages as text'
+        lines = ['Startup profile:']
+        previous = 0.0
+        for stage, elapsed in self.marks:
+            lines.append(f'  {stage:<16} {elapsed * 1000:8.1f} ms '
+                         f'(+{(elapsed - previous) * 1000:.1f} ms)')
+            previous = elapsed
+        return '\n'.join(lines)
@@ -0,0 +1,501 @@
+"""
+Statistics over the solves of cubestats.db.
+
+Times are read with their penalty applied (see core.solve_store) and
+rolling averages are stored with every solve in the avg5/avg12 columns.
+The solves of a session follow their dates: they are read in (Date, id)
+order through the (Session, Date, id) index, as the solves merged or synced
+from another device get new ids even when they are older. The position of
+a solve in its session is its (date, id) pair, ids never change.
+The statistics of every (session, cube) group are kept up to date in the
+session_stats table by triggers (see core.database), so
+``session_overview`` compares all the sessions without reading the solves.
+"""
+
+import numpy as np
+
+from core.periods import range_condition
+from core.solve_store import effective_time, penalty_from_cstimer
+
+
+AVERAGE_SIZES = (5, 12)
+
+# Time with its penalty applied, NULL for DNF solves
+_TIME = 'CASE WHEN Penalty = -1 THEN NULL WHEN Penalty = 2000 THEN Time + 2 ' \
+        'ELSE Time END'
+
+
+def _as_time(time, penalty):
+    'Converts a stored time and penalty to a float, DNF solves are infinite'
+    if not isinstance(time, (int, float)):
+        # Solves marked as DNF in the Time column by older versions
+        return float('inf')
+    return effective_time(time, penalty_from_cstimer(penalty))
+
+
+def trimmed_average(times):
+    """
+    Calculates the average of a list of solves.
+
+    As in csTimer2excel.calculate_avg the 5% best and worst solves are
+    removed. DNF solves count as the worst ones, so the average is a DNF
+    (infinite) when there are more DNFs than removed solves.
+    """
+    times = sorted(times)
+    remove = int(np.ceil(len(times) * 0.05))
+    times = times[remove:len(times) - remove]
+    if not times or times[-1] == float('inf'):
+        return float('inf')
+    return round(sum(times) / len(times), 3)
+
+
+def _stored_average(times, size):
+    'Average of the last size solves as stored in the database'
+    if len(times) < size:
+        return None
+    average = trimmed_average(times[-size:])
+    return average if average != float('inf') else None
+
+
+def refresh_averages(connection, session, position):
+    """
+    Recomputes the stored averages affected by a change of the solve at a
+    (date, id) position (or by its removal) in a session.
+
+    Only the solves whose windows include the changed position are
+    rewritten, the caller commits.
+    """
+    window = max(AVERAGE_SIZES) - 1
+    previous = connection.execute(
+        'SELECT Time, Penalty FROM solves WHERE Session = ? '
+        'AND (Date, id) < (?, ?) ORDER BY Date DESC, id DESC LIMIT ?',
+        (session, *position, window)).fetchall()
+    following = connection.execute(
+        'SELECT id, Time, Penalty FROM solves WHERE Session = ? '
+        'AND (Date, id) >= (?, ?) ORDER BY Date, id LIMIT ?',
+        (session, *position, window + 1)).fetchall()
+
+    times = [_as_time(time, penalty) for time, penalty in reversed(previous)]
+    updates = []
+    for solve_id, time, penalty in following:
+        times.append(_as_time(time, penalty))
+        updates.append(tuple(_stored_average(times, size)
+                             for size in AVERAGE_SIZES) + (solve_id,))
+    connection.executemany('UPDATE solves SET avg5 = ?, avg12 = ? WHERE id = ?',
+                           updates)
+
+
+def backfill_averages(connection, session=None, batch_size=10000,
+                      start=None):
+    """
+    Computes the stored averages of every solve (or of every solve of a
+    session) in one streamed scan. With start, a (date, id) position, only
+    the solves of the session from that position onwards are computed.
+    """
+    read = connection.cursor()
+    times = []
+    if session is None:
+        read.execute('SELECT id, Session, Time, Penalty FROM solves '
+                     'ORDER BY Session, Date, id')
+    elif start is None:
+        read.execute('SELECT id, Session, Time, Penalty FROM solves '
+                     'WHERE Session = ? ORDER BY Date, id', (session,))
+    else:
+        previous = connection.execute(
+            'SELECT Time, Penalty FROM solves WHERE Session = ? '
+            'AND (Date, id) < (?, ?) ORDER BY Date DESC, id DESC LIMIT ?',
+            (session, *start, max(AVERAGE_SIZES) - 1)).fetchall()
+        times = [_as_time(time, penalty) for time, penalty in reversed(previous)]
+        read.execute('SELECT id, Session, Time, Penalty FROM solves '
+                     'WHERE Session = ? AND (Date, id) >= (?, ?) '
+                     'ORDER BY Date, id', (session, *start))
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        updates = []
+        for solve_id, row_session, time, penalty in rows:
+            if row_session != session:
+                session = row_session
+                times = []
+            times.append(_as_time(time, penalty))
+            del times[:-max(AVERAGE_SIZES)]
+            updates.append(tuple(_stored_average(times, size)
+                                 for size in AVERAGE_SIZES) + (solve_id,))
+        connection.executemany(
+            'UPDATE solves SET avg5 = ?, avg12 = ? WHERE id = ?', updates)
+
+
+class Aggregate(object):
+    'Statistics of a group of solves (a session, a cube type or everything)'
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.valid = 0
+        self.total = 0.0
+        self.best = float('inf')
+        self.best_averages = {size: float('inf') for size in AVERAGE_SIZES}
+        self.date_start = None
+        self.date_end = None
+
+
+    @property
+    def mean(self):
+        'Mean of the non DNF solves'
+        return self.total / self.valid if self.valid else float('inf')
+
+
+    def merge(self, other):
+        'Adds the solves of another aggregate to this one'
+        self.count += other.count
+        self.valid += other.valid
+        self.total += other.total
+        self.best = min(self.best, other.best)
+        for size in AVERAGE_SIZES:
+            self.best_averages[size] = min(self.best_averages[size],
+                                           other.best_averages[size])
+        if other.date_start is not None:
+            if self.date_start is None or other.date_start < self.date_start:
+                self.date_start = other.date_start
+            if self.date_end is None or other.date_end > self.date_end:
+                self.date_end = other.date_end
+
+
+def _group_statistics(where, first_solves=False):
+    """
+    Query computing the statistics of the (session, cube) groups of the
+    solves selected by a WHERE clause, in the columns of session_stats.
+
+    With first_solves the query takes, before the parameters of the WHERE
+    clause, the (date, id) position of the first solve whose window of
+    every average size is selected, and only these averages count.
+    """
+    if first_solves:
+        best_averages = ', '.join(
+            f'MIN(CASE WHEN (Date, id) >= (?, ?) THEN avg{size} END)'
+            for size in AVERAGE_SIZES)
+    else:
+        best_averages = ', '.join(f'MIN(avg{size})' for size in AVERAGE_SIZES)
+    return f'''
+        SELECT Session, COALESCE(Cube, ''), COUNT(*), COUNT(Result),
+               TOTAL(Result), MIN(Result), MIN(Date), MAX(Date), {best_averages}
+        FROM (SELECT Session, Cube, Date, avg5, avg12, id, {_TIME} AS Result
+              FROM solves {where})
+        GROUP BY Session, Cube
+    '''
+
+
+def refresh_session_stats(connection, sessions=None):
+    """
+    Recomputes the statistics of the groups of some sessions in
+    session_stats, by default of the sessions with a stale group. Only
+    the solves of these sessions are read. The caller commits.
+    """
+    if sessions is None:
+        sessions = [name for (name,) in connection.execute(
+            'SELECT DISTINCT Session FROM session_stats WHERE Stale')]
+    query = _group_statistics('WHERE Session = ?')
+    for name in sessions:
+        connection.execute('DELETE FROM session_stats WHERE Session = ?',
+                           (name,))
+        connection.execute(f'''
+            INSERT INTO session_stats (Session, Cube, Solves, Valid, Total,
+                                       Best, DateStart, DateEnd, BestAvg5,
+                                       BestAvg12)
+            {query}
+        ''', (name,))
+
+
+def session_overview(connection, date_start=None, date_end=None):
+    """
+    Computes the statistics of every session, every cube type and all the
+    solves together, optionally only for the solves in a range of epoch
+    milliseconds.
+
+    Without a range the statistics are read from session_stats, only the
+    stale groups that no writer refreshed yet are computed from the solves.
+    A range is read session by session through the (Session, Date) index,
+    and the best averages only use the windows whose solves are all in the
+    range: the ones ending from the size-th solve of the session in the
+    range on.
+
+    Returns a tuple (sessions, cubes, total) where sessions and cubes are
+    dicts of Aggregate keyed by name. Sessions without solves are included
+    with empty statistics.
+    """
+    sessions = {}
+    cubes = {}
+    total = Aggregate('All sessions')
+
+    for (name,) in connection.execute('SELECT name FROM sessions'):
+        sessions[name] = Aggregate(name)
+
+    if date_start is None and date_end is None:
+        rows = connection.execute(
+            'SELECT Session, Cube, Solves, Valid, Total, Best, DateStart, '
+            'DateEnd, BestAvg5, BestAvg12 FROM session_stats '
+            'WHERE Session NOT IN (SELECT Session FROM session_stats '
+            'WHERE Stale)').fetchall()
+        query = _group_statistics('WHERE Session = ?')
+        for (name,) in connection.execute(
+                'SELECT DISTINCT Session FROM session_stats WHERE Stale'):
+            rows += connection.execute(query, (name,)).fetchall()
+    else:
+        where, parameters = range_condition(date_start=date_start,
+                                            date_end=date_end)
+        where += ' AND Session = ?'
+        query = _group_statistics(where, first_solves=True)
+        rows = []
+        for (name,) in connection.execute(
+                'SELECT DISTINCT Session FROM session_stats').fetchall():
+            first_solves = []
+            for size in AVERAGE_SIZES:
+                first_solves += connection.execute(
+                    f'SELECT Date, id FROM solves {where} ORDER BY Date, id '
+                    f'LIMIT 1 OFFSET ?', parameters + [name, size - 1]
+                ).fetchone() or (None, None)
+            rows += connection.execute(
+                query, first_solves + parameters + [name]).fetchall()
+    for row in rows:
+        session, cube = row[0], row[1] or 'Unknown'
+        group = Aggregate(session)
+        group.count, group.valid, group.total = row[2], row[3], row[4]
+        if row[5] is not None:
+            group.best = row[5]
+        group.date_start, group.date_end = row[6], row[7]
+        for size, best in zip(AVERAGE_SIZES, row[8:]):
+            if best is not None:
+                group.best_averages[size] = best
+
+        sessions.setdefault(session, Aggregate(session)).merge(group)
+        cubes.setdefault(cube, Aggregate(cube)).merge(group)
+        total.merge(group)
+
+    return sessions, cubes, total
+
+
+# Personal bests: for every session and window size a leaderboard of the
+# best results with the ids of the first and last solve of their window.
+# Windows are runs of consecutive solves in (Date, id) order.
+# A leaderboard keeps every window better than its cutoff (all of them when
+# the cutoff is NULL), so removing the windows touched by an edit and adding
+# their new results keeps it exact without reading the whole session. The
+# writers rebuild a leaderboard that edits leave with less than PB_DEPTH
+# windows, so the top PB_DEPTH can always be read from the table.
+
+PB_SIZES = (1, 5, 12, 100)
+PB_NAMES = {1: 'single', 5: 'ao5', 12: 'ao12', 100: 'ao100'}
+PB_DEPTH = 10
+# Results kept per leaderboard, the extra ones absorb the windows removed by
+# edits
+_PB_KEPT = 2 * PB_DEPTH
+
+
+def window_results(times, size):
+    """
+    Results of every window of size consecutive times (DNF solves are
+    infinite), as trimmed_average computes them. Result i is the one of
+    the window starting at times[i].
+    """
+    times = np.asarray(times, dtype=float)
+    if size == 1:
+        return times
+    if len(times) < size:
+        return np.empty(0)
+    remove = int(np.ceil(size * 0.05))
+    windows = np.sort(np.lib.stride_tricks.sliding_window_view(times, size),
+                      axis=1)[:, remove:size - remove]
+    return np.round(windows.mean(axis=1), 3)
+
+
+def _session_times(connection, session, condition, parameters,
+                   order='Date, id'):
+    'Reads the ids and times of some solves of a session'
+    rows = connection.execute(
+        f'SELECT id, Time, Penalty FROM solves WHERE Session = ? {condition} '
+        f'ORDER BY {order}', [session] + parameters).fetchall()
+    return ([solve_id for solve_id, _, _ in rows],
+            [_as_time(time, penalty) for _, time, penalty in rows])
+
+
+def _best_windows(results, starts, ends):
+    'Sorts windows by result, without the DNF ones'
+    valid = np.isfinite(results)
+    results, starts, ends = results[valid], starts[valid], ends[valid]
+    order = np.argsort(results, kind='stable')
+    return results[order], starts[order], ends[order]
+
+
+def rebuild_personal_bests(connection, session, batch_size=50000):
+    'Computes the leaderboards of a session in one streamed scan'
+    tail = max(PB_SIZES) - 1
+    kept = {size: (np.empty(0), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int64)) for size in PB_SIZES}
+    cutoffs = dict.fromkeys(PB_SIZES)
+    ids, times = [], []
+    read = connection.execute('SELECT id, Time, Penalty FROM solves '
+                              'WHERE Session = ? ORDER BY Date, id', (session,))
+    while rows := read.fetchmany(batch_size):
+        # The last solves of the previous batch start the windows of this one
+        done = len(ids)
+        ids = np.array(list(ids) + [row[0] for row in rows], dtype=np.int64)
+        times = np.array(list(times) + [_as_time(time, penalty)
+                                        for _, time, penalty in rows])
+        for size in PB_SIZES:
+            first = max(0, done - size + 1)
+            results = window_results(times[first:], size)
+            results, starts, ends = _best_windows(
+                np.concatenate((kept[size][0], results)),
+                np.concatenate((kept[size][1], ids[first:][:len(results)])),
+                np.concatenate((kept[size][2], ids[first + size - 1:])))
+            if len(results) > _PB_KEPT:
+                dropped = results[_PB_KEPT]
+                if cutoffs[size] is None or dropped < cutoffs[size]:
+                    cutoffs[size] = float(dropped)
+            kept[size] = (results[:_PB_KEPT], starts[:_PB_KEPT],
+                          ends[:_PB_KEPT])
+        ids, times = ids[-tail:], times[-tail:]
+
+    clear_personal_bests(connection, session)
+    for size in PB_SIZES:
+        connection.executemany(
+            'INSERT INTO personal_bests VALUES (?, ?, ?, ?, ?)',
+            [(session, size, int(end), int(start), float(result))
+             for result, start, end in zip(*kept[size])])
+        connection.execute('INSERT INTO personal_best_boards VALUES (?, ?, ?)',
+                           (session, size, cutoffs[size]))
+
+
+def clear_personal_bests(connection, session):
+    'Removes the leaderboards of a session'
+    connection.execute('DELETE FROM personal_bests WHERE Session = ?',
+                       (session,))
+    connection.execute('DELETE FROM personal_best_boards WHERE Session = ?',
+                       (session,))
+
+
+def update_personal_bests(connection, session, position, local=True):
+    """
+    Updates the leaderboards of a session after the solve at a (date, id)
+    position was added, modified or removed. Only the windows around it are
+    read. With local=False every window from the position to the end is
+    recomputed instead, as after adding many solves to the session.
+
+    Returns {size: result} for the windows that beat the previous best of
+    their leaderboard. The caller commits.
+    """
+    cutoffs = dict(connection.execute(
+        'SELECT Size, Cutoff FROM personal_best_boards WHERE Session = ?',
+        (session,)))
+    if len(cutoffs) < len(PB_SIZES):
+        rebuild_personal_bests(connection, session)
+        return {}
+
+    tail = max(PB_SIZES) - 1
+    previous_ids, previous_times = _session_times(
+        connection, session, 'AND (Date, id) < (?, ?)', list(position),
+        f'Date DESC, id DESC LIMIT {tail}')
+    limit = f' LIMIT {max(PB_SIZES)}' if local else ''
+    following_ids, following_times = _session_times(
+        connection, session, 'AND (Date, id) >= (?, ?)', list(position),
+        'Date, id' + limit)
+    ids = np.array(previous_ids[::-1] + following_ids, dtype=np.int64)
+    times = previous_times[::-1] + following_times
+
+    new_bests = {}
+    drained = False
+    for size in PB_SIZES:
+        best = connection.execute(
+            'SELECT MIN(Result) FROM personal_bests WHERE Session = ? '
+            'AND Size = ?', (session, size)).fetchone()[0]
+        # The windows that included the position end at the solve, when it
+        # was removed, or at one of the size solves that follow it now
+        ending = set(following_ids[:size] if local else following_ids)
+        ending.add(position[1])
+        connection.executemany(
+            'DELETE FROM personal_bests WHERE Session = ? AND Size = ? '
+            'AND EndId = ?',
+            [(session, size, end) for (end,) in connection.execute(
+                'SELECT EndId FROM personal_bests WHERE Session = ? '
+                'AND Size = ?', (session, size)).fetchall() if end in ending])
+
+        # Windows ending at the position or after it (only the ones that
+        # include it when local)
+        first = max(0, len(previous_ids) - size + 1)
+        results = window_results(times[first:], size)
+        starts = ids[first:][:len(results)]
+        ends = ids[first + size - 1:]
+        if local:
+            results, starts, ends = results[:size], starts[:size], ends[:size]
+        cutoff = cutoffs[size]
+        better = np.isfinite(results) if cutoff is None else results < cutoff
+        connection.executemany(
+            'INSERT OR REPLACE INTO personal_bests VALUES (?, ?, ?, ?, ?)',
+            [(session, size, int(end), int(start), float(result))
+             for result, start, end in zip(results[better], starts[better],
+                                           ends[better])])
+
+        dropped = connection.execute(
+            'SELECT EndId, Result FROM personal_bests WHERE Session = ? '
+            'AND Size = ? ORDER BY Result LIMIT -1 OFFSET ?',
+            (session, size, _PB_KEPT)).fetchall()
+        if dropped:
+            cutoff = min(result for _, result in dropped)
+            connection.executemany(
+                'DELETE FROM personal_bests WHERE Session = ? AND Size = ? '
+                'AND EndId = ?', [(session, size, end) for end, _ in dropped])
+            connection.execute(
+                'UPDATE personal_best_boards SET Cutoff = ? '
+                'WHERE Session = ? AND Size = ?', (cutoff, session, size))
+        elif cutoff is not None:
+            kept = connection.execute(
+                'SELECT COUNT(*) FROM personal_bests WHERE Session = ? '
+                'AND Size = ?', (session, size)).fetchone()[0]
+            drained = drained or kept < PB_DEPTH
+
+        if best is not None and better.any() and results[better].min() < best:
+            new_bests[size] = float(results[better].min())
+    if drained:
+        # Edits removed too many windows better than the cutoff
+        rebuild_personal_bests(connection, session)
+    return new_bests
+
+
+def repair_personal_bests(connection, solves, rebuild_above=200):
+    """
+    Updates the leaderboards around modified solves, given as (session,
+    date, id) tuples. The sessions with more than rebuild_above modified
+    solves are rebuilt instead. The caller commits.
+    """
+    sessions = {}
+    for session, date, solve_id in solves:
+        sessions.setdefault(session, set()).add((date, solve_id))
+    for session, positions in sessions.items():
+        if len(positions) > rebuild_above:
+            rebuild_personal_bests(connection, session)
+        else:
+            for position in sorted(positions):
+                update_personal_bests(connection, session, position)
+
+
+def personal_bests(connection, session, size, limit=PB_DEPTH):
+    """
+    Returns the best windows of size solves of a session, best first, as
+    (result, start id, end id, first date, last date) tuples. limit can not
+    be greater than PB_DEPTH.
+    """
+    return connection.execute(
+        'SELECT p.Result, p.StartId, p.EndId, first.Date, last.Date '
+        'FROM personal_bests AS p '
+        'JOIN solves AS first ON first.id = p.StartId '
+        'JOIN solves AS last ON last.id = p.EndId '
+        'WHERE p.Session = ? AND p.Size = ? ORDER BY p.Result LIMIT ?',
+        (session, size, min(limit, PB_DEPTH))).fetchall()
+
+
+def best_results(connection, session):
+    'Returns {size: best result} of the leaderboards of a session'
+    return dict(connection.execute(
+        'SELECT Size, MIN(Result) FROM personal_bests WHERE Session = ? '
+        'GROUP BY Size', (session,)))
@@ -0,0 +1,406 @@
+"""
+Replication of the solves between devices.
+
+Every database keeps an append-only log of its changes (the ``changes``
+table filled by triggers, see core.database) with the peer each change was
+received from. One device runs a ``SyncServer`` and the others call
+``sync``, which pushes the changes logged since the last sync, except the
+ones pulled from that server, and pulls the changes of the server since the
+last pulled sequence number. Only these deltas travel, in batches of zlib
+compressed JSON frames. A server started with a token only answers the
+requests that carry it.
+
+Solves are identified by their fingerprint on every device. A change only
+carries the current state of its solve, so applying a change twice does
+nothing and the last change applied to a solve wins.
+"""
+
+import asyncio
+import hmac
+import json
+import sqlite3
+import struct
+import zlib
+
+from core.database import DB_PATH, connect
+from core.scramble import decode_scrambles, encode_scrambles
+from core.stats import (backfill_averages, refresh_session_stats,
+                        repair_personal_bests, update_personal_bests)
+
+
+DEFAULT_PORT = 8765
+BATCH_SIZE = 5000
+# Largest frame and largest message once decompressed, a batch of
+# BATCH_SIZE changes takes a few hundred KiB of JSON
+MAX_FRAME_SIZE = 1024 * 1024
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024
+
+_HEADER = struct.Struct('>I')
+
+
+class SyncError(Exception):
+    'Raised when a peer sends an invalid frame'
+
+
+async def read_frame(reader):
+    'Reads a length prefixed, compressed JSON message, None at the end'
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise SyncError(f'Frame of {size} bytes is too large')
+    # The output is bounded, a small frame can not expand to gigabytes
+    # before the server checks the token
+    decompressor = zlib.decompressobj()
+    message = decompressor.decompress(await reader.readexactly(size),
+                                      MAX_MESSAGE_SIZE)
+    if decompressor.unconsumed_tail:
+        raise SyncError(f'Message larger than {MAX_MESSAGE_SIZE} bytes')
+    if not decompressor.eof or decompressor.unused_data:
+        raise SyncError('Invalid frame')
+    return json.loads(message)
+
+
+async def write_frame(writer, message):
+    'Writes a message as a length prefixed, compressed JSON frame'
+    data = zlib.compress(json.dumps(message, separators=(',', ':')).encode())
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+def read_changes(connection, since, limit=BATCH_SIZE, skip_origin=None):
+    """
+    Returns up to limit changes with a sequence number greater than since,
+    as [seq, op, fingerprint, session, time, penalty, date, mix, cube]
+    lists with the current state of the solve (None when it was removed).
+    The changes received from skip_origin are left out. Scrambles are sent
+    as text.
+    """
+    condition, parameters = '', [since]
+    if skip_origin is not None:
+        condition = 'AND c.Origin IS NOT ?'
+        parameters.append(skip_origin)
+    changes = [list(row) for row in connection.execute(f'''
+        SELECT c.seq, c.Op, c.Fingerprint, s.Session, s.Time, s.Penalty,
+               s.Date, s.Mix, s.Cube
+        FROM changes AS c
+        LEFT JOIN solves AS s ON s.id = (SELECT MIN(id) FROM solves
+                                         WHERE Fingerprint = c.Fingerprint)
+        WHERE c.seq > ? {condition}
+        ORDER BY c.seq
+        LIMIT ?
+    ''', parameters + [limit])]
+    mixes = decode_scrambles([change[7] for change in changes])
+    for change, mix in zip(changes, mixes):
+        change[7] = mix
+    return changes
+
+
+def last_sequence(connection):
+    'Sequence number of the last logged change'
+    return connection.execute(
+        'SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+
+def _insert_solves(cursor, rows):
+    """
+    Inserts the solves of consecutive insert changes whose fingerprint is
+    missing, with one anti-join over a temporary table as in the importer.
+    Returns the number of inserted solves and the (session, date, id)
+    position before which no solve of every session was inserted.
+    """
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS sync_inserts (
+            seq INTEGER, Session TEXT, Time REAL, Penalty TEXT, Date INTEGER,
+            Mix TEXT, Cube TEXT, Fingerprint INTEGER
+        )
+    ''')
+    cursor.execute('DELETE FROM sync_inserts')
+    mixes = encode_scrambles([row[5] for row in rows])
+    cursor.executemany('INSERT INTO sync_inserts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       [row[:5] + (mix,) + row[6:]
+                        for row, mix in zip(rows, mixes)])
+    last_id = cursor.execute(
+        'SELECT COALESCE(MAX(id), 0) FROM solves').fetchone()[0]
+    cursor.execute('''
+        INSERT INTO solves (Session, Time, Penalty, Date, Mix, Cube,
+                            Fingerprint)
+        SELECT Session, Time, Penalty, Date, Mix, Cube, Fingerprint
+        FROM (SELECT MIN(seq) AS seq, Session, Time, Penalty, Date, Mix,
+                     Cube, Fingerprint
+              FROM sync_inserts GROUP BY Fingerprint) AS new
+        WHERE NOT EXISTS (SELECT 1 FROM solves
+                          WHERE solves.Fingerprint = new.Fingerprint)
+        ORDER BY seq
+    ''')
+    inserted = cursor.rowcount
+    # The new solves have greater ids than the ones of the same date
+    return inserted, cursor.execute(
+        'SELECT Session, MIN(Date), ? FROM solves WHERE id > ? '
+        'GROUP BY Session', (last_id + 1, last_id)).fetchall()
+
+
+def apply_changes(connection, changes, origin=None, pulled=None):
+    """
+    Applies changes read by read_changes on another device in one
+    transaction and repairs the stored averages and the personal bests of
+    the affected sessions.
+
+    The entries they add to the local log record origin, the peer they
+    come from. When they were pulled from it, the pulled cursor of the
+    peer moves to pulled in the same transaction. Returns the number of
+    modified solves.
+    """
+    cursor = connection.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        before = last_sequence(connection)
+        # First modified (date, id) position of every session, its
+        # averages are recomputed from there
+        starts = {}
+        # First position of the solves added to every session and (session,
+        # date, id) of the other modified solves, for the personal bests
+        appended = {}
+        edited = []
+        modified = 0
+        inserts = []
+
+        def touch(solves):
+            for name, date, solve_id in solves:
+                starts[name] = min(starts.get(name, (date, solve_id)),
+                                   (date, solve_id))
+
+        def flush_inserts():
+            # Changes are applied in order, the pending inserts go first
+            nonlocal modified
+            if inserts:
+                inserted, solves = _insert_solves(cursor, inserts)
+                modified += inserted
+                touch(solves)
+                for name, date, solve_id in solves:
+                    appended[name] = min(appended.get(name, (date, solve_id)),
+                                         (date, solve_id))
+                inserts.clear()
+
+        for seq, op, fingerprint, session, time, penalty, date, mix, cube \
+                in changes:
+            if op != 'delete' and session is None:
+                # The solve was removed afterwards, a delete follows
+                continue
+            if op == 'insert':
+                inserts.append((seq, session, time, penalty, date, mix, cube,
+                                fingerprint))
+                continue
+            flush_inserts()
+
+            solves = cursor.execute(
+                'SELECT Session, Date, MIN(id) FROM solves '
+                'WHERE Fingerprint = ? GROUP BY Session',
+                (fingerprint,)).fetchall()
+            if op == 'penalty':
+                cursor.execute('UPDATE solves SET Penalty = ? '
+                               'WHERE Fingerprint = ? AND Penalty IS NOT ?',
+                               (penalty, fingerprint, penalty))
+            elif op == 'session':
+                cursor.execute('UPDATE solves SET Session = ? '
+                               'WHERE Fingerprint = ? AND Session IS NOT ?',
+                               (session, fingerprint, session))
+                solves += [(session, date, solve_id)
+                           for _, date, solve_id in solves]
+            elif op == 'delete':
+                cursor.execute('DELETE FROM solves WHERE Fingerprint = ?',
+                               (fingerprint,))
+            else:
+                raise SyncError(f'Unknown change {op!r}')
+            if cursor.rowcount > 0:
+                modified += cursor.rowcount
+                touch(solves)
+                edited += solves
+        flush_inserts()
+
+        cursor.executemany('INSERT OR IGNORE INTO sessions(name) VALUES (?)',
+                           [(name,) for name in starts])
+        # Solves added by the other device may be older than the last local
+        # ones, every window from the first of them on is recomputed
+        for name, start in starts.items():
+            backfill_averages(connection, name, start=start)
+        for name, position in appended.items():
+            update_personal_bests(connection, name, position, local=False)
+        repair_personal_bests(connection, edited)
+        refresh_session_stats(connection)
+        if origin is not None:
+            cursor.execute('UPDATE changes SET Origin = ? WHERE seq > ?',
+                           (origin, before))
+        if pulled is not None:
+            cursor.execute('UPDATE sync_state SET pulled = ? WHERE peer = ?',
+                           (pulled, origin))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return modified
+
+
+class SyncServer:
+    """
+    Serves the change log of a database to the devices that sync with it.
+
+    Requests are {"type": "pull", "since": seq, "limit": n}, answered with
+    {"changes": [...], "last": seq}, and {"type": "push", "changes": [...]},
+    answered with {"applied": n}. With a token every request must carry it
+    as "token", the connection is closed after a request without it. The
+    database is used from a worker thread, one request at a time, so the
+    event loop keeps serving the others.
+    """
+
+    def __init__(self, db_path=DB_PATH, host='127.0.0.1', port=DEFAULT_PORT,
+                 token=None):
+        # Used from the worker threads, one at a time
+        self.connection = connect(db_path, check_same_thread=False)
+        self.host = host
+        self.port = port
+        self.token = token
+        self.lock = asyncio.Lock()
+        self.server = None
+
+
+    async def start(self):
+        'Starts listening, returns the (host, port) the server is bound to'
+        self.server = await asyncio.start_server(self.handle, self.host,
+                                                 self.port)
+        return self.server.sockets[0].getsockname()[:2]
+
+
+    async def close(self):
+        'Stops listening and closes the database'
+        self.server.close()
+        await self.server.wait_closed()
+        self.connection.close()
+
+
+    async def serve_forever(self):
+        'Serves the clients until the task is cancelled'
+        await self.server.serve_forever()
+
+
+    async def run(self, function, *args):
+        'Runs a database function in a worker thread'
+        async with self.lock:
+            return await asyncio.to_thread(function, self.connection, *args)
+
+
+    def authorized(self, request):
+        'Whether a request carries the token of the server, if it has one'
+        if self.token is None:
+            return True
+        token = request.get('token')
+        return isinstance(token, str) and hmac.compare_digest(
+            token.encode(), self.token.encode())
+
+
+    async def handle(self, reader, writer):
+        'Answers the requests of a client until it disconnects'
+        client = writer.get_extra_info('peername')[0]
+        try:
+            while (request := await read_frame(reader)) is not None:
+                if not self.authorized(request):
+                    await write_frame(writer, {'error': 'Invalid token'})
+                    break
+                if request.get('type') == 'pull':
+                    limit = min(int(request.get('limit', BATCH_SIZE)),
+                                BATCH_SIZE)
+                    changes = await self.run(read_changes,
+                                             int(request['since']), limit)
+                    last = await self.run(last_sequence)
+                    await write_frame(writer, {'changes': changes,
+                                               'last': last})
+                elif request.get('type') == 'push':
+                    applied = await self.run(apply_changes,
+                                             request['changes'], client)
+                    await write_frame(writer, {'applied': applied})
+                else:
+                    await write_frame(writer, {'error': 'Unknown request'})
+        except (SyncError, ValueError, KeyError, zlib.error,
+                sqlite3.Error) as error:
+            # Also a push that finds the database locked by another writer
+            await write_frame(writer, {'error': str(error)})
+        finally:
+            writer.close()
+
+
+def _cursors(connection, peer):
+    'Returns the (pulled, pushed) sequence numbers of a peer'
+    connection.execute('INSERT OR IGNORE INTO sync_state(peer) VALUES (?)',
+                       (peer,))
+    connection.commit()
+    return connection.execute(
+        'SELECT pulled, pushed FROM sync_state WHERE peer = ?',
+        (peer,)).fetchone()
+
+
+async def _request(reader, writer, message):
+    'Sends a request and returns the answer of the server'
+    await write_frame(writer, message)
+    answer = await read_frame(reader)
+    if answer is None:
+        raise SyncError('The server closed the connection')
+    if 'error' in answer:
+        raise SyncError(answer['error'])
+    return answer
+
+
+def _save_pushed(connection, peer, pushed):
+    'Saves the pushed cursor of a peer'
+    connection.execute('UPDATE sync_state SET pushed = ? WHERE peer = ?',
+                       (pushed, peer))
+    connection.commit()
+
+
+async def sync(connection, host='127.0.0.1', port=DEFAULT_PORT,
+               batch_size=BATCH_SIZE, token=None):
+    """
+    Pushes the local changes to a server and pulls its new changes, with
+    the token of the server if it has one.
+
+    The cursors are saved after every batch, so an interrupted sync resumes
+    where it stopped. Returns the (pushed, pulled) numbers of changes.
+    """
+    peer = f'{host}:{port}'
+    pulled, pushed = _cursors(connection, peer)
+    # Every change up to there is pushed, except the ones from the server
+    end = last_sequence(connection)
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = received = 0
+
+    async def request(message):
+        if token is not None:
+            message['token'] = token
+        return await _request(reader, writer, message)
+
+    try:
+        while changes := read_changes(connection, pushed, batch_size, peer):
+            await request({'type': 'push', 'changes': changes})
+            pushed = changes[-1][0]
+            sent += len(changes)
+            _save_pushed(connection, peer, pushed)
+        if pushed < end:
+            # The last changes were pulled from the server, skip them for good
+            _save_pushed(connection, peer, end)
+
+        while True:
+            answer = await request({'type': 'pull', 'since': pulled,
+                                    'limit': batch_size})
+            changes = answer['changes']
+            if not changes:
+                break
+            apply_changes(connection, changes, peer, changes[-1][0])
+            pulled = changes[-1][0]
+            received += len(changes)
+            if pulled >= answer['last']:
+                break
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return sent, received
@@ -3,13 +3,37 @@ Creates a .csv file from a csTimer .txt file.
 
 Usage:
     python csTimer2excel.py <input_file> <output_file>
+    python csTimer2excel.py <input_file> --database <database>
+    python csTimer2excel.py <directory or glob> [-o <output_dir>] [-j <jobs>]
+                            [--watch]
+    python csTimer2excel.py <directory or glob> --database <database>
+                            [--watch]
 
 Arguments:
-    input_file: The .txt file to be converted.
-    output_file: The .csv file to be created.
+    input_file: The .txt file to be converted, or a directory (its .txt and
+                .json files) or a glob pattern to convert several exports
+                in one process.
+    output_file: The .csv file to be created, next to the input file when
+                 missing. The summary of the sessions goes next to it, in
+                 <output_file>_sessions.csv.
+    output_dir: The directory of the .csv files of several exports, next
+                to every export when missing.
+    database: Merges the solves into this cubestats database instead,
+              skipping the ones that are already there. The exports are
+              merged one after the other, in this process.
+    jobs: The number of worker processes converting exports, one per CPU
+          by default.
+    watch: Keeps converting the exports that are added or modified, until
+           interrupted. Files are checked every <interval> seconds (2 by
+           default) and skipped while their modification time and size do
+           not change. With a database only the exports added or modified
+           after the start are merged, the existing ones are merged by a
+           run without --watch.
 
 Example:
     python csTimer2excel.py -i cstimer.txt -o output.csv
+    python csTimer2excel.py -i cstimer.txt -d database/cubestats.db
+    python csTimer2excel.py -i exports/ -o csv/ --watch
 
 Dependencies:
     pandas
@@ -27,14 +51,32 @@ Author:
 
 import numpy as np
 import argparse
+import glob
+import itertools
 import json
+import os
 import pandas as pd
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 
+from core.database import connect, solve_fingerprint
+from core.scramble import encode_scrambles
+from core.solve_store import cube_from_cstimer
+from core.stats import (backfill_averages, refresh_session_stats,
+                        update_personal_bests)
+
+EXPORT_PATTERNS = ('*.txt', '*.json')
+
+
 class csTimer2excel:
     def __init__(self, input_file, output_file = None):
         self.input_file = open(input_file, 'r')
-        self.output_file = output_file
+        self.output_file = output_file or default_output(input_file)
+        self.sessions_file = (os.path.splitext(self.output_file)[0] +
+                              '_sessions.csv')
 
         self.data = json.load(self.input_file)
         self.properties = self.data['properties']
@@ -196,29 +238,267 @@ class csTimer2excel:
        
         # Save the DataFrames to .csv files
         df.to_csv(self.output_file, index = False)
-        self.sessions_df.to_csv('sessions.csv', index = False)
+        self.sessions_df.to_csv(self.sessions_file, index = False)
 
         self.input_file.close()
 
 
+    def iter_solves(self):
+        """
+        Yields (fingerprint, session, timestamp, time, penalty, scramble,
+        cube) for the solves of every session.
+        """
+        for i in range(1, self.properties['sessionN'] + 1):
+            name_session = str(self.sessionData[str(i)]['name'])
+            options = self.sessionData[str(i)].get('opt', {})
+            cube = cube_from_cstimer(options.get('scrType'))
+            for scramble in self.data.get('session' + str(i), []):
+                penalty, milliseconds = scramble[0][0], scramble[0][1]
+                timestamp = scramble[-1]
+                mix = scramble[1]
+                yield (solve_fingerprint(timestamp, milliseconds, mix),
+                       name_session, timestamp, milliseconds / 1000,
+                       penalty, mix, cube)
+
+
+    def merge(self, database):
+        """
+        Merges the solves into a cubestats database.
+
+        The solves are staged in a temporary table and only the ones whose
+        fingerprint is missing from the database are inserted, with a single
+        anti-join instead of one lookup per solve. Solves older than the
+        last ones of their session keep their new ids, the statistics read
+        the sessions in date order. Returns the number of solves added.
+        """
+        connection = connect(database)
+        try:
+            return self._merge(connection)
+        finally:
+            # Rolls back a merge that failed, so the database is not left
+            # locked
+            connection.close()
+            self.input_file.close()
+
+
+    def _merge(self, connection):
+        'Merges the solves in a transaction of connection, see merge'
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('''
+            CREATE TEMP TABLE import_solves (
+                Fingerprint INTEGER,
+                Session TEXT,
+                Timestamp INTEGER,
+                Time REAL,
+                Penalty TEXT,
+                Mix TEXT,
+                Cube TEXT
+            )
+        ''')
+        solves = self.iter_solves()
+        while rows := list(itertools.islice(solves, 10000)):
+            # Scrambles are stored packed
+            mixes = encode_scrambles([row[5] for row in rows])
+            cursor.executemany(
+                'INSERT INTO import_solves VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [row[:5] + (mix, row[6]) for row, mix in zip(rows, mixes)])
+
+        last_id = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM solves').fetchone()[0]
+        cursor.execute('''
+            INSERT INTO solves (Session, Date, Time, Penalty, Mix, Cube,
+                                Fingerprint)
+            SELECT Session, Timestamp * 1000, Time, Penalty, Mix, Cube,
+                   Fingerprint
+            FROM import_solves AS new
+            WHERE NOT EXISTS (SELECT 1 FROM solves
+                              WHERE solves.Fingerprint = new.Fingerprint)
+            GROUP BY Fingerprint
+            ORDER BY Session, Timestamp
+        ''')
+        added = cursor.rowcount
+        cursor.execute('DROP TABLE import_solves')
+
+        # The merged solves keep the ids of the existing ones and take their
+        # place by date: the windows are recomputed from the (date, id)
+        # position of the oldest one, before the ones of the same date
+        sessions = cursor.execute(
+            'SELECT Session, MIN(Date) FROM solves WHERE id > ? '
+            'GROUP BY Session', (last_id,)).fetchall()
+        cursor.executemany('INSERT OR IGNORE INTO sessions(name) VALUES (?)',
+                           [(name,) for name, _ in sessions])
+        for name, date in sessions:
+            start = (date, last_id + 1)
+            backfill_averages(connection, name, start=start)
+            update_personal_bests(connection, name, start, local=False)
+        refresh_session_stats(connection)
+        connection.commit()
+        return added
+
+
     def save(self):
         pass
-    
+
+
+def default_output(input_file, output_dir=None):
+    'The .csv file written for an export, next to it or in output_dir'
+    output = os.path.splitext(input_file)[0] + '.csv'
+    if output_dir:
+        output = os.path.join(output_dir, os.path.basename(output))
+    return output
+
+
+def find_exports(source):
+    """
+    Returns the csTimer exports of a directory (its .txt and .json files)
+    or matching a glob pattern, sorted.
+    """
+    if os.path.isdir(source):
+        paths = [path for pattern in EXPORT_PATTERNS
+                 for path in glob.glob(os.path.join(source, pattern))]
+    else:
+        paths = glob.glob(source)
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and not path.endswith('.csv'))
+
+
+def convert_file(input_file, output_dir=None):
+    'Converts an export to the .csv files next to it or in output_dir'
+    converter = csTimer2excel(input_file,
+                              default_output(input_file, output_dir))
+    converter.convert()
+    return converter.output_file
+
+
+def convert_batch(input_files, database=None, pool=None, output_dir=None):
+    """
+    Converts several exports, in the worker processes of pool when given,
+    or merges them one after the other into database. Prints the result of
+    every file, a file that can not be read does not stop the others.
+
+    Returns the exports that could not be merged because of the database
+    (locked by another process for instance), to be merged again later.
+    """
+    if database or pool is None or len(input_files) == 1:
+        jobs = [(path, None) for path in input_files]
+    else:
+        jobs = [(path, pool.submit(convert_file, path, output_dir))
+                for path in input_files]
+
+    retry = []
+    for path, future in jobs:
+        try:
+            if future is not None:
+                result = f'converted to {future.result()}'
+            elif database:
+                result = f'{csTimer2excel(path).merge(database)} new solves'
+            else:
+                result = f'converted to {convert_file(path, output_dir)}'
+        except sqlite3.Error as error:
+            result = f'failed ({error}), will be merged again'
+            retry.append(path)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            result = f'failed ({error})'
+        print(f'{path}: {result}')
+    return retry
+
+
+def _signature(path):
+    '(modification time, size) of a file, None when it is gone'
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _up_to_date(path, output_dir=None):
+    'True when the .csv of an export is newer than the export'
+    output = default_output(path, output_dir)
+    return (os.path.exists(output) and
+            os.path.getmtime(output) >= os.path.getmtime(path))
+
+
+def watch(source, database=None, pool=None, interval=2.0, output_dir=None):
+    """
+    Converts the exports of source as they are added or modified, until
+    interrupted.
+
+    A file is converted once its modification time and size are the same
+    on two consecutive checks, so exports still being written are not read,
+    and it is skipped until they change again. Exports whose .csv is already
+    newer are skipped at start, and every existing export when merging into
+    a database: merges skip the known solves but would still read them all.
+    Exports that could not be merged because of the database are merged
+    again on the next check.
+    """
+    done = {path: _signature(path) for path in find_exports(source)
+            if database or _up_to_date(path, output_dir)}
+    previous = {}
+    while True:
+        current = {path: _signature(path) for path in find_exports(source)}
+        ready = [path for path, signature in current.items()
+                 if signature is not None and previous.get(path) == signature
+                 and done.get(path) != signature]
+        if ready:
+            retry = convert_batch(ready, database, pool, output_dir)
+            done.update((path, current[path]) for path in ready
+                        if path not in retry)
+        previous = current
+        time.sleep(interval)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Converts a csTimer .txt file to a .xlsx file.')
     parser.add_argument('--input_file', '-i', type=str,
-                        help='The .txt file to be converted.')
+                        help='The .txt file to be converted, or a directory '
+                             'or glob pattern of exports.')
     parser.add_argument('--output_file', '-o', type=str,
-                        help='The .xlsx file to be created.')
+                        help='The .xlsx file to be created, or the directory '
+                             'of the files of several exports.')
+    parser.add_argument('--database', '-d', type=str,
+                        help='Merge the solves into this database instead.')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='The number of worker processes of a batch.')
+    parser.add_argument('--watch', '-w', action='store_true',
+                        help='Keep converting new or modified exports.')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='Seconds between the checks of --watch.')
     args = parser.parse_args()
 
     input_file = args.input_file
     output_file = args.output_file
-
-    converter = csTimer2excel(input_file, output_file)
-    converter.convert()
-    converter.save()
-
-    print('Conversion complete.')
\ No newline at end of file
+    batch = not os.path.isfile(input_file) or args.watch
+
+    if output_file and args.database:
+        parser.error('--output_file can not be used with --database')
+    if output_file and batch and not os.path.isdir(output_file):
+        parser.error(f'--output_file must be an existing directory with a '
+                     f'directory, a glob or --watch: {output_file}')
+
+    if not batch:
+        converter = csTimer2excel(input_file, output_file)
+        if args.database:
+            added = converter.merge(args.database)
+            print(f'Merge complete, {added} new solves.')
+        else:
+            converter.convert()
+            converter.save()
+
+            print('Conversion complete.')
+    else:
+        # Merges into a database run one after the other, without workers
+        workers = (nullcontext() if args.database
+                   else ProcessPoolExecutor(args.jobs))
+        with workers as pool:
+            if args.watch:
+                try:
+                    watch(input_file, args.database, pool, args.interval,
+                          output_file)
+                except KeyboardInterrupt:
+                    pass
+            else:
+                convert_batch(find_exports(input_file), args.database, pool,
+                              output_file)
\ No newline at end of file
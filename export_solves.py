@@ -0,0 +1,192 @@
+"""
+Exports the solves of cubestats.db to a .csv file or to a csTimer export.
+
+The solves are streamed from the database in batches, so the memory used
+does not depend on the number of solves.
+
+Usage:
+    python export_solves.py [-f {csv,cstimer}] [-o <output_file>]
+                            [-s <session>] [--since <date>] [--until <date>]
+
+Arguments:
+    format: csv (default) or cstimer, the .txt/.json format that csTimer
+            imports and that csTimer2excel.py converts.
+    output_file: The file to be created, stdout when missing or '-'.
+    session: Only export this session.
+    since, until: Only export solves in this range of dates (inclusive),
+                  as 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'.
+
+Example:
+    python export_solves.py -f cstimer -o cstimer.txt --since 2025-04-01
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from contextlib import nullcontext
+from datetime import datetime
+
+from core.database import DB_PATH, connect, iter_solves
+from core.periods import epoch_ms
+from core.scramble import decode_scrambles
+from core.solve_store import (PENALTY_DNF, cube_to_cstimer, effective_time,
+                              penalty_from_cstimer, penalty_to_cstimer)
+
+
+class SolvesExporter:
+    columns = ['Session', 'id', 'Date', 'Time', 'Penalty', 'Mix', 'Cube']
+
+    def __init__(self, connection, session=None, date_start=None,
+                 date_end=None):
+        self.connection = connection
+        self.session = session
+        self.date_start = date_start
+        self.date_end = date_end
+
+
+    def batches(self):
+        """
+        Yields the selected solves in batches, ordered by session and
+        date, with their scrambles unpacked.
+        """
+        mix = self.columns.index('Mix')
+        for rows in iter_solves(self.connection, self.columns, self.session,
+                                self.date_start, self.date_end):
+            mixes = decode_scrambles([row[mix] for row in rows])
+            yield [row[:mix] + (text,) + row[mix + 1:]
+                   for row, text in zip(rows, mixes)]
+
+
+    def export_csv(self, output):
+        """
+        Writes the solves as .csv rows with the columns of csTimer2excel.
+        """
+        writer = csv.writer(output)
+        writer.writerow(['Session', 'Num', 'Date', 'Time', 'Penalty',
+                         'Scramble', 'Cube'])
+        session = None
+        for rows in self.batches():
+            for name, _, date, time, penalty, mix, cube in rows:
+                if name != session:
+                    session = name
+                    num = 0
+                num += 1
+                writer.writerow([name, num, format_date(date), time, penalty,
+                                 mix, cube])
+
+
+    def export_cstimer(self, output):
+        """
+        Writes the solves in the JSON format of a csTimer export.
+
+        Every session is written as soon as its solves are read, the session
+        summary needed by csTimer goes in the properties at the end.
+        """
+        session_data = {}
+        session = None
+        output.write('{')
+        for rows in self.batches():
+            for name, _, date, time, penalty, mix, cube in rows:
+                if name != session:
+                    if session is not None:
+                        output.write('], ')
+                    session = name
+                    index = len(session_data) + 1
+                    stat = {'name': name, 'count': 0, 'dnf': 0, 'total': 0,
+                            'date': [None, None], 'cube': cube}
+                    session_data[str(index)] = stat
+                    output.write(f'"session{index}": [')
+                else:
+                    output.write(', ')
+
+                timestamp = date // 1000
+                penalty = penalty_from_cstimer(penalty)
+                result = [penalty_to_cstimer(penalty),
+                          int(round(time * 1000)) if time is not None else 0]
+                if penalty & PENALTY_DNF:
+                    stat['dnf'] += 1
+                else:
+                    stat['total'] += round(effective_time(time, penalty) * 1000)
+                stat['count'] += 1
+                if stat['date'][0] is None:
+                    stat['date'][0] = timestamp
+                stat['date'][1] = timestamp
+                output.write(json.dumps([result, mix or '', '', timestamp]))
+
+        if session is not None:
+            output.write('], ')
+
+        for index, stat in session_data.items():
+            valid = stat['count'] - stat['dnf']
+            mean = round(stat['total'] / valid) if valid else -1
+            # csTimer has one scramble type per session, the first cube's
+            scramble_type = cube_to_cstimer(stat['cube'])
+            options = {'scrType': scramble_type} if scramble_type else {}
+            session_data[index] = {'name': stat['name'], 'opt': options,
+                                   'rank': int(index),
+                                   'stat': [stat['count'], stat['dnf'], mean],
+                                   'date': stat['date']}
+        properties = {'sessionN': len(session_data),
+                      'sessionData': json.dumps(session_data)}
+        output.write(f'"properties": {json.dumps(properties)}}}')
+
+
+def format_date(date):
+    """
+    Converts epoch milliseconds to the date format of csTimer2excel.
+    """
+    return datetime.fromtimestamp(date / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_date(text, end=False):
+    """
+    Converts a command line date to epoch milliseconds.
+    """
+    if text is None:
+        return None
+    if len(text) == 10:
+        text += ' 23:59:59.999' if end else ' 00:00:00'
+    elif end:
+        text += '.999'
+    return epoch_ms(datetime.fromisoformat(text))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exports the solves of cubestats.db.')
+    parser.add_argument('--format', '-f', choices=['csv', 'cstimer'],
+                        default='csv', help='The format of the export.')
+    parser.add_argument('--output_file', '-o', type=str, default='-',
+                        help='The file to be created, stdout by default.')
+    parser.add_argument('--database', '-d', type=str, default=DB_PATH,
+                        help='The database to export.')
+    parser.add_argument('--session', '-s', type=str,
+                        help='Only export this session.')
+    parser.add_argument('--since', type=str,
+                        help='Only export solves from this date.')
+    parser.add_argument('--until', type=str,
+                        help='Only export solves up to this date.')
+    args = parser.parse_args()
+
+    exporter = SolvesExporter(connect(args.database), args.session,
+                              parse_date(args.since),
+                              parse_date(args.until, end=True))
+    if args.output_file == '-':
+        output = nullcontext(sys.stdout)
+    else:
+        output = open(args.output_file, 'w', newline='')
+    export = (exporter.export_csv if args.format == 'csv'
+              else exporter.export_cstimer)
+
+    try:
+        with output as stream:
+            export(stream)
+    except BrokenPipeError:
+        # The command reading stdout (head, less) exited. Python flushes
+        # stdout again at exit, so it goes to devnull to exit quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    if args.output_file != '-':
+        print('Export complete.')
@@ -1,12 +1,15 @@
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
-                             QLineEdit, QPushButton, QTableWidgetItem)
+                             QLineEdit, QPushButton, QComboBox)
+
+from core.edits import (apply_penalty, delete_solves, move_solves,
+                        parse_solve_numbers, format_solve_numbers)
 
 class ModifyDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Modify Time")
         self.layout = QVBoxLayout(self)
-        self.label = QLabel("Solve to modify:", self)
+        self.label = QLabel("Solves to modify (e.g. 3, 10-25):", self)
         self.layout.addWidget(self.label)
         self.line_edit = QLineEdit(self)
         self.layout.addWidget(self.line_edit)
@@ -24,46 +27,59 @@ class ModifyDialog(QDialog):
         self.button_layout.addWidget(self.remove_button)
         self.layout.addLayout(self.button_layout)
 
+        # Move to session layout
+        self.move_layout = QHBoxLayout()
+        self.session_combo = QComboBox(self)
+        parent_combo = self.parent().comboBox_session
+        for i in range(parent_combo.count()):
+            if parent_combo.itemText(i) != self.parent().session:
+                self.session_combo.addItem(parent_combo.itemText(i))
+        self.move_layout.addWidget(self.session_combo)
+        self.move_button = QPushButton('Move', self)
+        self.move_button.clicked.connect(self.modify_time)
+        self.move_button.setEnabled(self.session_combo.count() > 0)
+        self.move_layout.addWidget(self.move_button)
+        self.layout.addLayout(self.move_layout)
+
         # Set up database connection
         self.db_connection = self.parent().db_connection
         self.cursor = self.db_connection.cursor()
-        self.table = self.parent().table_previous_times
+        self.solves = self.parent().solves
+
+        # Start with the solves selected in the table
+        table = self.parent().table_previous_times
+        selected = sorted({index.row() for index in
+                           table.selectionModel().selectedRows()})
+        self.line_edit.setText(format_solve_numbers(selected))
 
     def modify_time(self):
-        'Modify chosen solve time'
-        solve_num = self.line_edit.text()
+        'Modify chosen solve times'
         modification = self.sender().text()
-        if not solve_num.isdigit():
-            self.parent().statusBar().showMessage('Invalid solve number')
+        if self.parent().reload_if_stale():
+            # The solve numbers may no longer be the solves shown
+            self.reject()
             return
-
-        index = int(solve_num) - 1
-        if index < 0 or index >= self.table.rowCount():
+        indices = parse_solve_numbers(self.line_edit.text(), len(self.solves))
+        if not indices:
             self.parent().statusBar().showMessage('Invalid solve number (out of range)')
             return
 
-        solve_id = int(self.table.item(index, 0).text())
+        solve_ids = [self.solves.ids[index] for index in indices]
         if modification == '+2':
-            current_time = self.table.item(index, 1).text()
-            if current_time != 'DNF':
-                new_time = round(float(current_time) + 2, 3)
-                self.table.setItem(index, 1, QTableWidgetItem(str(new_time)))
-                self.cursor.execute(
-                    "UPDATE solves SET time = ? WHERE id = ?",
-                    (new_time, solve_id))
-                
+            modified = apply_penalty(self.db_connection, solve_ids, 2000)
+
         elif modification == 'DNF':
-            self.table.setItem(index, 1, QTableWidgetItem('DNF'))
-            self.cursor.execute(
-                "UPDATE solves SET time = 'DNF' WHERE id = ?", (solve_id,))
+            modified = apply_penalty(self.db_connection, solve_ids, -1)
 
         elif modification == 'Remove':
-            self.table.removeRow(index)
-            self.cursor.execute(
-                "DELETE FROM solves WHERE id = ?", (solve_id,))
-        
-        
-        # Commit the changes and update the table
-        self.db_connection.commit()
-        self.parent().table_previous_times.setRowCount(0)
-        self.parent().load_saved_solves()
\ No newline at end of file
+            modified = delete_solves(self.db_connection, solve_ids)
+
+        elif modification == 'Move':
+            session = self.session_combo.currentText()
+            modified = move_solves(self.db_connection, solve_ids, session)
+            self.parent().session_cache.invalidate(session)
+
+        # Update the table once for all the changes
+        self.parent().reload_saved_solves()
+        self.parent().statusBar().showMessage(f'{modified} solves modified')
+        self.accept()
@@ -1,6 +1,6 @@
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel,
-    QSpinBox, QCheckBox
+    QSpinBox, QCheckBox, QComboBox
 )
 
 class OptionsDialog(QDialog):
@@ -17,11 +17,42 @@ class OptionsDialog(QDialog):
         self.spinBox_scramble_length = QSpinBox(self)
         self.spinBox_scramble_length.setMinimum(10)
         self.spinBox_scramble_length.setMaximum(30)
-        self.spinBox_scramble_length.setValue(20)
+        self.spinBox_scramble_length.setValue(
+            self.parent().options.scramble_length)
         self.horizontal_layout.addWidget(self.spinBox_scramble_length)
 
         self.layout.addLayout(self.horizontal_layout)
 
+        # Session cache controls
+        self.cache_layout = QHBoxLayout()
+        self.label_cache_size = QLabel('Cached solves of recent sessions:',
+                                       self)
+        self.cache_layout.addWidget(self.label_cache_size)
+
+        self.spinBox_cache_size = QSpinBox(self)
+        self.spinBox_cache_size.setMinimum(0)
+        self.spinBox_cache_size.setMaximum(10000000)
+        self.spinBox_cache_size.setSingleStep(10000)
+        self.spinBox_cache_size.setValue(
+            self.parent().options.session_cache_size)
+        self.cache_layout.addWidget(self.spinBox_cache_size)
+
+        self.layout.addLayout(self.cache_layout)
+
+        # Running timer refresh controls
+        self.refresh_layout = QHBoxLayout()
+        self.label_timer_refresh = QLabel('Running timer refresh:', self)
+        self.refresh_layout.addWidget(self.label_timer_refresh)
+
+        self.comboBox_timer_refresh = QComboBox(self)
+        self.comboBox_timer_refresh.addItems(
+            ['100 Hz', '60 Hz', 'Seconds only', 'Hidden'])
+        self.comboBox_timer_refresh.setCurrentText(
+            self.parent().options.timer_refresh)
+        self.refresh_layout.addWidget(self.comboBox_timer_refresh)
+
+        self.layout.addLayout(self.refresh_layout)
+
         # Checkboxes
         self.checkBox_showTimes = QCheckBox('Show times', self)
         self.layout.addWidget(self.checkBox_showTimes)
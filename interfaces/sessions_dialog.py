@@ -0,0 +1,114 @@
+from PyQt6.QtCore import QDateTime
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
+                             QComboBox, QTableWidget, QTableWidgetItem,
+                             QHeaderView)
+
+from core.periods import period_range
+from core.stats import PB_NAMES, personal_bests, session_overview
+
+
+class SessionsDialog(QDialog):
+    'Overview of the statistics of every session and their personal bests'
+
+    columns = ['Name', 'Solves', 'Best', 'Mean', 'Best ao5', 'Best ao12',
+               'First solve', 'Last solve']
+    best_columns = ['Rank', 'Result', 'First solve', 'Last solve']
+    periods = {'All time': 'all', 'Today': 'today', 'Last 7 days': 'week',
+               'This month': 'month', 'This year': 'year'}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Sessions")
+        self.resize(820, 640)
+        self.layout = QVBoxLayout(self)
+
+        # Period selection
+        self.period_layout = QHBoxLayout()
+        self.label_period = QLabel("Period:", self)
+        self.period_layout.addWidget(self.label_period)
+        self.comboBox_period = QComboBox(self)
+        self.comboBox_period.addItems(list(self.periods))
+        self.comboBox_period.currentTextChanged.connect(self.load_overview)
+        self.period_layout.addWidget(self.comboBox_period)
+        self.layout.addLayout(self.period_layout)
+
+        self.label_sessions = QLabel("Sessions", self)
+        self.layout.addWidget(self.label_sessions)
+        self.table_sessions = self.create_table(self.columns)
+        self.layout.addWidget(self.table_sessions)
+
+        self.label_cubes = QLabel("Cube types", self)
+        self.layout.addWidget(self.label_cubes)
+        self.table_cubes = self.create_table(self.columns)
+        self.layout.addWidget(self.table_cubes)
+
+        # Leaderboard of a session, read from the personal bests index
+        self.bests_layout = QHBoxLayout()
+        self.label_bests = QLabel("Personal bests of", self)
+        self.bests_layout.addWidget(self.label_bests)
+        self.comboBox_best_session = QComboBox(self)
+        sessions = self.parent().comboBox_session
+        self.comboBox_best_session.addItems(
+            [sessions.itemText(index) for index in range(sessions.count())])
+        self.comboBox_best_session.setCurrentText(self.parent().session)
+        self.comboBox_best_session.currentTextChanged.connect(self.load_bests)
+        self.bests_layout.addWidget(self.comboBox_best_session)
+        self.comboBox_best_size = QComboBox(self)
+        self.comboBox_best_size.addItems(list(PB_NAMES.values()))
+        self.comboBox_best_size.currentTextChanged.connect(self.load_bests)
+        self.bests_layout.addWidget(self.comboBox_best_size)
+        self.layout.addLayout(self.bests_layout)
+        self.table_bests = self.create_table(self.best_columns)
+        self.layout.addWidget(self.table_bests)
+
+        self.load_overview()
+        self.load_bests()
+
+    def create_table(self, columns):
+        'Creates an empty read only table'
+        table = QTableWidget(0, len(columns), self)
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        table.verticalHeader().hide()
+        table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeMode.ResizeToContents)
+        return table
+
+    def load_overview(self):
+        'Computes the statistics of the selected period'
+        date_start, date_end = period_range(
+            self.periods[self.comboBox_period.currentText()])
+        sessions, cubes, total = session_overview(
+            self.parent().db_connection, date_start, date_end)
+        self.fill_table(self.table_sessions, list(sessions.values()) + [total])
+        self.fill_table(self.table_cubes, list(cubes.values()))
+
+    def load_bests(self):
+        'Shows the leaderboard of the selected session and window size'
+        size = list(PB_NAMES)[self.comboBox_best_size.currentIndex()]
+        rows = personal_bests(self.parent().db_connection,
+                              self.comboBox_best_session.currentText(), size)
+        self.table_bests.setRowCount(len(rows))
+        for row, (result, _, _, date_start, date_end) in enumerate(rows):
+            values = [str(row + 1), f'{result:.3f}'] + [
+                QDateTime.fromMSecsSinceEpoch(date).toString(
+                    'yyyy-MM-dd HH:mm:ss') for date in (date_start, date_end)]
+            for column, value in enumerate(values):
+                self.table_bests.setItem(row, column, QTableWidgetItem(value))
+
+    def fill_table(self, table, aggregates):
+        'Writes one row per aggregate'
+        table.setRowCount(len(aggregates))
+        for row, aggregate in enumerate(aggregates):
+            values = [aggregate.name, aggregate.count, aggregate.best,
+                      aggregate.mean, aggregate.best_averages[5],
+                      aggregate.best_averages[12]]
+            for date in (aggregate.date_start, aggregate.date_end):
+                values.append(QDateTime.fromMSecsSinceEpoch(date).toString(
+                    'yyyy-MM-dd HH:mm:ss') if date is not None else None)
+            for column, value in enumerate(values):
+                if isinstance(value, float):
+                    value = f'{value:.3f}' if value != float('inf') else 'N/A'
+                elif value is None:
+                    value = '-'
+                table.setItem(row, column, QTableWidgetItem(str(value)))
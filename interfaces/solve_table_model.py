@@ -0,0 +1,87 @@
+from PyQt6.QtCore import QAbstractTableModel, QDateTime, QModelIndex, Qt
+
+from core.solve_store import format_time
+
+
+class SolveTableModel(QAbstractTableModel):
+    """
+    Table of previous times of a session, read from its SolveStore.
+
+    Cells are formatted when the view paints them, so showing a session
+    does not create one item per solve, and the model is cached with the
+    session (see core.session_cache) to show it again instantly.
+    """
+
+    headers = ['id', 'Time (s)', 'Date']
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        row = index.row()
+        if index.column() == 0:
+            return str(self.store.ids[row])
+        if index.column() == 1:
+            return format_time(self.store.times[row], self.store.penalties[row])
+        return QDateTime.fromMSecsSinceEpoch(self.store.dates[row]).toString(
+            'yyyy-MM-dd HH:mm:ss')
+
+
+    def headerData(self, section, orientation,
+                   role=Qt.ItemDataRole.DisplayRole):
+        if (orientation == Qt.Orientation.Horizontal and
+                role == Qt.ItemDataRole.DisplayRole):
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+
+    def extend(self, rows):
+        'Adds (id, raw time, date, Penalty column value) rows'
+        rows = list(rows)
+        if rows:
+            start = len(self.store)
+            self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+            self.store.extend(rows)
+            self.endInsertRows()
+
+
+    def append(self, solve_id, time, date):
+        'Adds a solve without penalty'
+        row = len(self.store)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.store.append(solve_id, time, date)
+        self.endInsertRows()
+
+
+    def set_id(self, row, solve_id):
+        'Sets the id of a solve once it is saved'
+        self.store.ids[row] = solve_id
+        index = self.index(row % len(self.store), 0)
+        self.dataChanged.emit(index, index)
+
+
+    def set_penalty(self, row, penalty):
+        'Changes the penalty of a solve'
+        self.store.set_penalty(row, penalty)
+        index = self.index(row % len(self.store), 1)
+        self.dataChanged.emit(index, index)
+
+
+    def pop(self, row):
+        'Removes a solve'
+        row %= len(self.store)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.store.pop(row)
+        self.endRemoveRows()
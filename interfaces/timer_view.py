@@ -71,11 +71,9 @@ class Ui_MainWindow(object):
         self.button_remove = QtWidgets.QPushButton(parent=self.verticalLayoutWidget)
         self.button_remove.setObjectName("button_remove")
         self.verticalLayout.addWidget(self.button_remove)
-        self.table_previous_times = QtWidgets.QTableWidget(parent=self.centralwidget)
+        self.table_previous_times = QtWidgets.QTableView(parent=self.centralwidget)
         self.table_previous_times.setGeometry(QtCore.QRect(10, 150, 240, 451))
         self.table_previous_times.setObjectName("table_previous_times")
-        self.table_previous_times.setColumnCount(0)
-        self.table_previous_times.setRowCount(0)
         self.comboBox_session = QtWidgets.QComboBox(parent=self.centralwidget)
         self.comboBox_session.setGeometry(QtCore.QRect(10, 30, 240, 32))
         self.comboBox_session.setAcceptDrops(False)
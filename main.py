@@ -1,18 +1,45 @@
+from core.startup_profile import StartupProfile
+
+STARTUP_PROFILE = StartupProfile()
+
+import argparse
 import random
-import numpy as np
 import sys
 
-from PyQt6.QtCore import Qt, QTime, QTimer, pyqtSignal, QDateTime
+from PyQt6.QtCore import (Qt, QTime, QTimer, QElapsedTimer, pyqtSignal,
+                          QDateTime)
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QColorDialog, QDialog,
                              QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QPushButton, QComboBox, QTableWidget,
-                             QTableWidgetItem, QHeaderView)
+                             QPushButton, QComboBox, QHeaderView,
+                             QAbstractItemView)
 
 import sqlite3
 
 from interfaces.timer_view import Ui_MainWindow
 from interfaces.modify_dialog import ModifyDialog
 from interfaces.options_dialog import OptionsDialog
+from interfaces.sessions_dialog import SessionsDialog
+from interfaces.solve_table_model import SolveTableModel
+from core.database import DB_PATH, connect, solve_fingerprint
+from core.scramble import FACES, MODIFIERS, encode_scramble
+from core.session_cache import SessionCache, SessionData
+from core.session_loader import SessionLoader
+from core.solve_store import SolveStore, PENALTY_PLUS2, PENALTY_DNF
+from core.stats import (AVERAGE_SIZES, PB_NAMES, trimmed_average,
+                        refresh_averages, update_personal_bests,
+                        clear_personal_bests, best_results,
+                        refresh_session_stats)
+
+STARTUP_PROFILE.mark('imports')
+
+# Tick interval in ms and decimals of the running time for every timer
+# refresh option, no interval means the time is hidden until the end
+TIMER_REFRESH = {
+    '100 Hz': (10, 3),
+    '60 Hz': (16, 2),
+    'Seconds only': (1000, 0),
+    'Hidden': (None, 0),
+}
 
 
 class Options(object):
@@ -26,16 +53,30 @@ class Options(object):
         self.show_cube = False
         self.show_moves = False
         self.show_stats = False
+        self.session_cache_size = 100000
+        self.timer_refresh = '100 Hz'
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     """
     Runtime logic for the timer window
+
+    Only the widgets and the timer are set up when the window is created.
+    The database, the sessions and the solves are loaded once, after the
+    window is painted for the first time.
     """
 
-    def __init__(self):
+    # Emitted once the first session is fully loaded
+    startup_finished = pyqtSignal()
+
+    def __init__(self, startup_profile=None):
         super().__init__()
+        self.startup_profile = startup_profile or StartupProfile()
         self.setupUi(self)
+        # The time label never changes size, so setting its text while the
+        # timer runs does not ask the window for a new layout
+        self.label_time.setFixedSize(self.label_time.size())
+        self.label_time.setTextFormat(Qt.TextFormat.PlainText)
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
         self.setFocus()
 
@@ -45,7 +86,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # Timer setup
         self.timer = QTimer(self, interval=10)
         self.timer.timeout.connect(self.update_timer)
-        self.start_time = None
+        self.solve_clock = QElapsedTimer()
+        self.shown_time = None
         self.elapsed_time = 0.0
         self.running = False
         self.statusBar().showMessage('Do your first solve')
@@ -56,43 +98,29 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.session = self.comboBox_session.currentText()
         
         # Set up time variables
-        self.all_solves = []
+        self.session_cache = SessionCache(self.options.session_cache_size)
+        self.loaded_session = None
+        self.loader = None
+        self.pending_solves = []
+        self.solves = SolveStore()
+        self.model = SolveTableModel(self.solves)
         self.fastest_time = float('inf')
         self.solves_count = 0
-        self.last5_times = []
-        self.last12_times = []
-        self.best_ao5 = float('inf')
-        self.best_ao12 = float('inf')
 
-        # Setup database connection
-        self.db_connection = sqlite3.connect('database/cubestats.db')
-        self.cursor = self.db_connection.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS solves (
-                Session TEXT,
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                Date TEXT,
-                Time REAL,
-                Penalty TEXT,
-                Mix TEXT,
-                avg5 REAL,
-                avg12 REAL,
-                avg100 REAL,
-                avg1000 REAL,
-                avg5000 REAL,
-                avg10000 REAL
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                name TEXT PRIMARY KEY
-            )
-        ''')
-
-        self.db_connection.commit()
+        # The database is opened after the first paint
+        self.db_path = DB_PATH
+        self.db_connection = None
+        self.cursor = None
+        # Changes when another process commits to the database
+        self.data_version = None
+        self.database_requested = False
         self.setup_table()
-        self.load_saved_solves()
-        self.load_sessions()
+        self.set_loading(True)
+        self.actionSessions.setEnabled(False)
+        self.comboBox_session.setEnabled(False)
+        self.button_new_session.setEnabled(False)
+        self.button_remove_session.setEnabled(False)
+        self.statusBar().showMessage('Loading sessions...')
 
         # Set up options
         self.is_focus_active = False
@@ -109,10 +137,41 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.button_DNF.clicked.connect(self.modify_time)
         self.button_remove.clicked.connect(self.modify_time)
         self.actionOptions.triggered.connect(self.options_dialog)
+        self.actionSessions.triggered.connect(self.sessions_dialog)
         self.color_timer.timeout.connect(self._turn_label_green)
         self.comboBox_session.currentTextChanged.connect(self.load_saved_solves)
         self.button_new_session.clicked.connect(self.new_session)
         self.button_remove_session.clicked.connect(self.delete_session)
+        self.startup_profile.mark('window created')
+
+
+    def paintEvent(self, event):
+        'Starts loading the data once the window has been painted'
+        super().paintEvent(event)
+        if not self.database_requested:
+            self.database_requested = True
+            self.startup_profile.mark('first paint')
+            QTimer.singleShot(0, self.load_database)
+
+
+    def load_database(self):
+        'Opens the database and loads the sessions and the first one'
+        self.db_connection = connect(self.db_path)
+        self.cursor = self.db_connection.cursor()
+        self.data_version = self.cursor.execute(
+            'PRAGMA data_version').fetchone()[0]
+        self.startup_profile.mark('database open')
+
+        # Signals are blocked so the session is loaded exactly once
+        self.comboBox_session.blockSignals(True)
+        self.load_sessions()
+        self.comboBox_session.blockSignals(False)
+        self.comboBox_session.setEnabled(True)
+        self.actionSessions.setEnabled(True)
+        self.button_new_session.setEnabled(True)
+        self.button_remove_session.setEnabled(True)
+        self.startup_profile.mark('sessions loaded')
+        self.load_saved_solves()
 
     
     def _turn_label_green(self):
@@ -152,9 +211,22 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     def setup_table(self):
         'Sets up the table for the previous times'
-        self.table_previous_times.setColumnCount(3)
-        self.table_previous_times.setHorizontalHeaderLabels(['id', 'Time (s)',
-                                                             'Date'])
+        self.show_model(self.model)
+        self.table_previous_times.setSelectionBehavior(
+            QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table_previous_times.setSelectionMode(
+            QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.table_previous_times.setEditTriggers(
+            QAbstractItemView.EditTrigger.NoEditTriggers)
+
+
+    def show_model(self, model):
+        'Shows the table model of a session in the table of previous times'
+        selection = self.table_previous_times.selectionModel()
+        self.table_previous_times.setModel(model)
+        if selection is not None:
+            # The view does not delete the selection model it replaces
+            selection.deleteLater()
         self.table_previous_times.hideColumn(0)
         header = self.table_previous_times.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
@@ -179,45 +251,169 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
 
     def load_saved_solves(self):
-        'Loads the saved solves from the database'
-        self.session = self.comboBox_session.currentText()
+        'Loads the saved solves from the session cache or in the background'
+        self.cancel_loading()
+        self.forget_stale_sessions()
+        session = self.comboBox_session.currentText()
 
-        # Reset in-memory stats
-        self.all_solves = []
-        self.solves_count = 0
-        self.fastest_time = float('inf')
-        self.best_ao5 = float('inf')
-        self.best_ao12 = float('inf')
-        self.last5_times = []
-        self.last12_times = []
-        self.table_previous_times.setRowCount(0)
+        # The session is taken out of the cache before the one being
+        # replaced goes in, so caching the latter can not evict it
+        data = self.session_cache.take(session)
+        if data is None and session == self.loaded_session:
+            data = SessionData(self.solves, self.model)
+            self.loaded_session = None
+        self.cache_loaded_session()
+        self.session = session
+        if data is not None:
+            self.show_session_data(data)
+            return
 
-        self.cursor.execute(
-            'SELECT id, Time, Date FROM solves WHERE Session = ? ORDER BY id',
-            (self.session,)
-        )
-        rows = self.cursor.fetchall()
-
-        self.solves_count = len(rows)
-        self.all_solves = [row[1] if isinstance(row[1], (int, float)) else float('inf') for row in rows]
-
-        if self.all_solves:
-            self.fastest_time = min(self.all_solves)
-            
-        for solve_id, time, date in rows:
-            row = self.table_previous_times.rowCount()
-            self.table_previous_times.insertRow(row)
-            self.table_previous_times.setItem(row, 0, QTableWidgetItem(str(solve_id)))
-            self.table_previous_times.setItem(row, 1, QTableWidgetItem(str(time)))
-            self.table_previous_times.setItem(row, 2, QTableWidgetItem(str(date)))
-
-        # Refresh status bar
+        # Reset in-memory stats and stream the solves from the database
+        store = SolveStore()
+        self.show_session_data(SessionData(store, SolveTableModel(store)))
+        self.loaded_session = None
+        self.pending_solves = []
+        self.set_loading(True)
+        self.loader = SessionLoader(self.db_path, self.session, parent=self)
+        self.loader.chunk_loaded.connect(self.receive_chunk)
+        self.loader.loading_finished.connect(self.finish_loading)
+        self.loader.finished.connect(self.loader.deleteLater)
+        self.loader.start()
+
+
+    def show_session_data(self, data):
+        'Shows the solves and statistics of a session'
+        self.solves = data.store
+        self.model = data.model
+        self.solves_count = len(data.store)
+        self.fastest_time = data.store.best()
+        self.loaded_session = self.session
+        self.show_model(data.model)
+        self.show_session_status()
+
+
+    def show_session_status(self, loading=False):
+        'Shows the statistics of the session in the status bar'
         fastest_str = (f'{self.fastest_time:.3f}'
                         if self.fastest_time != float('inf') else 'N/A')
+        if loading:
+            self.statusBar().showMessage(
+                f'Loading session "{self.session}": {self.solves_count} '
+                f'solves so far, Fastest: {fastest_str} s'
+            )
+        else:
+            self.statusBar().showMessage(
+                f'Session "{self.session}": {self.solves_count} solves, '
+                f'Fastest: {fastest_str} s'
+            )
+
+
+    def receive_chunk(self, rows):
+        'Shows a chunk of the session being loaded'
+        if self.sender() is not self.loader:
+            # Chunk of a load that was cancelled
+            return
+        self.append_rows(rows)
+        self.show_session_status(loading=True)
+        self.loader.chunk_shown.release()
+
+
+    def append_rows(self, rows):
+        'Appends (id, Time, Date, Penalty) rows to the session'
+        start = len(self.solves)
+        self.model.extend(rows)
+        self.solves_count = len(self.solves)
+        self.fastest_time = min(self.fastest_time,
+                                float(self.solves.effective_times(start).min()))
+
+
+    def finish_loading(self):
+        'Adds the solves saved while loading and marks the session as loaded'
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        last_id = self.solves.ids[-1] if len(self.solves) else 0
+        pending = [solve_id for solve_id in self.pending_solves
+                   if solve_id > last_id]
+        if pending:
+            self.append_rows(self.cursor.execute(
+                'SELECT id, Time, Date, Penalty FROM solves '
+                f'WHERE id IN ({", ".join("?" * len(pending))}) '
+                'ORDER BY Date, id',
+                pending).fetchall())
+        self.pending_solves = []
+        self.loaded_session = self.session
+        self.set_loading(False)
+        self.show_session_status()
+
+        if 'fully loaded' not in self.startup_profile.stages:
+            self.startup_profile.mark('fully loaded')
+            self.startup_finished.emit()
+
+
+    def cancel_loading(self, wait=False):
+        'Stops the session being loaded, if any'
+        if self.loader is not None:
+            self.loader.requestInterruption()
+            if wait:
+                self.loader.wait()
+            self.loader = None
+            self.set_loading(False)
+
+
+    def set_loading(self, loading):
+        'Disables the modifications of solves while the session loads'
+        for button in (self.button_modify_time, self.button_plus2,
+                       self.button_DNF, self.button_remove):
+            button.setEnabled(not loading)
+
+
+    def closeEvent(self, event):
+        'Stops the background loading before closing'
+        self.cancel_loading(wait=True)
+        super().closeEvent(event)
+
+
+    def cache_loaded_session(self):
+        'Keeps the solves of the session being replaced in the session cache'
+        if self.loaded_session is not None:
+            self.session_cache.put(self.loaded_session,
+                                   SessionData(self.solves, self.model))
+            self.loaded_session = None
+
+
+    def reload_saved_solves(self):
+        'Reloads the current session after its solves changed in the database'
+        self.loaded_session = None
+        self.session_cache.invalidate(self.session)
+        self.load_saved_solves()
+
+
+    def forget_stale_sessions(self):
+        """
+        Drops the sessions held in memory when another process (an import
+        or a sync) committed to the database since the last check, as their
+        solves may have been added, modified, moved or removed there.
+        Returns True when they were dropped.
+        """
+        version = self.cursor.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return False
+        self.data_version = version
+        self.session_cache.clear()
+        self.loaded_session = None
+        return True
+
+
+    def reload_if_stale(self):
+        'Reloads the session if another process changed the database'
+        if not self.forget_stale_sessions():
+            return False
+        self.load_saved_solves()
         self.statusBar().showMessage(
-            f'Session "{self.session}": {self.solves_count} solves, '
-            f'Fastest: {fastest_str} s'
-        )
+            'The database was changed by another program, the session was '
+            'reloaded')
+        return True
 
 
     def update_scramble(self):
@@ -230,8 +426,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def generate_scramble(self):
         'Generates a ramdom scramble for the selected cube type'
         if self.options.cube_type == '3x3':
-            faces = ['R', 'L', 'U', 'D', 'F', 'B']
-            modifiers = ['', "'", '2']
+            faces = FACES
+            modifiers = MODIFIERS
             scramble = []
             prev_face = ''
             for _ in range(self.options.scramble_length):
@@ -245,7 +441,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         
         elif self.options.cube_type == '2x2':
             faces = ['R', 'U', 'F']
-            modifiers = ['', "'", '2']
+            modifiers = MODIFIERS
             scramble = []
             prev_face = ''
             for _ in range(self.options.scramble_length):
@@ -259,33 +455,48 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
 
     def update_timer(self):
-        'Updates the timer display'
-        if self.is_focus_active:
+        'Updates the timer display when the shown digits change'
+        decimals = TIMER_REFRESH[self.options.timer_refresh][1]
+        elapsed = self.solve_clock.elapsed()
+        if decimals:
+            text = f'{elapsed / 1000:.{decimals}f}'
+        else:
+            text = str(elapsed // 1000)
+            # Next tick when the next second starts
+            self.timer.start(1000 - elapsed % 1000)
+        if text != self.shown_time:
+            self.shown_time = text
+            self.label_time.setText(text)
+
+
+    def show_running_time(self):
+        'Starts or stops ticking for the focus mode and the refresh option'
+        interval = TIMER_REFRESH[self.options.timer_refresh][0]
+        if self.is_focus_active or interval is None:
+            self.timer.stop()
+            self.shown_time = ''
             self.label_time.setText('')
-            return
-        current_time = QTime.currentTime()
-        elapsed = current_time.msecsSinceStartOfDay() - self.start_time
-        self.label_time.setText(f"{elapsed / 1000:.3f}")
+        else:
+            self.timer.start(interval)
+            self.update_timer()
 
     
     def start_timer(self):
         'Starts the timer'
         if not self.running:
-            if self.is_focus_active:
-                self.label_time.setText('')
-            else:
-                self.label_time.setText('0.000')
-            
-            self.start_time = QTime.currentTime().msecsSinceStartOfDay()
+            self.solve_clock.start()
             self.running = True
             self.elapsed_time = 0
-            self.timer.start()
-
-            if  self.solves_count > 0:
-                ao5_str = f'{self.best_ao5:.3f}' if self.best_ao5 != float('inf') else 'N/A'
-                ao12_str = f'{self.best_ao12:.3f}' if self.best_ao12 != float('inf') else 'N/A'
-                fastest_str = f'{self.fastest_time:.3f}' if self.fastest_time != float('inf') else 'N/A'
-                self.statusBar().showMessage(f'Fastest: {fastest_str} s - Best ao5: {ao5_str} s - Best ao12: {ao12_str} s')
+            self.shown_time = None
+            self.show_running_time()
+
+            if self.db_connection is not None and self.solves_count > 0:
+                # Read from the personal bests, which edits keep up to date
+                bests = best_results(self.db_connection, self.session)
+                self.statusBar().showMessage(' - '.join(
+                    f'Best {PB_NAMES[size]}: {bests[size]:.3f} s'
+                    if size in bests else f'Best {PB_NAMES[size]}: N/A'
+                    for size in PB_NAMES))
             else:
                 self.statusBar().showMessage('Do your first solve')
 
@@ -295,13 +506,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if self.running:
             self.timer.stop()
             self.running = False
-            current_msec = QTime.currentTime().msecsSinceStartOfDay()
-
-            self.elapsed_time = current_msec - self.start_time
+            self.elapsed_time = self.solve_clock.elapsed()
             self.label_time.setText(f"{self.elapsed_time / 1000:.3f}")
 
-            self.update_scramble()
             self.save_time()
+            self.update_scramble()
 
     
     def new_session(self):
@@ -341,7 +550,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.cursor.execute(
             'DELETE FROM sessions WHERE name = ?', (session,)
         )
+        clear_personal_bests(self.db_connection, session)
         self.db_connection.commit()
+        self.session_cache.invalidate(session)
+        self.loaded_session = None
 
         # remove from combo and pick fallback
         idx = self.comboBox_session.currentIndex()
@@ -360,44 +572,65 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def save_time(self):
         'Add solve to the label_past_times'
         time = float(self.label_time.text())
-        date = QDateTime.currentDateTime().toString('yyyy-MM-dd HH:mm:ss')
-        # Insert the time into the database
+        now = QDateTime.currentDateTime()
+        mix = self.label_scramble.text()
+        fingerprint = solve_fingerprint(now.toSecsSinceEpoch(),
+                                        round(time * 1000), mix)
+        mix = encode_scramble(mix)
         self.session = self.comboBox_session.currentText()
-        self.cursor.execute('INSERT INTO solves (Session, Time, Date) VALUES \
-                            (?, ?, ?)', (self.session, time, str(date)))
-        self.db_connection.commit()
-        solve_id = self.cursor.lastrowid
+        date = now.toMSecsSinceEpoch()
+
+        stale = self.forget_stale_sessions()
+        if self.loader is not None or stale:
+            # The solve is shown once the session finishes loading
+            self.cursor.execute('INSERT INTO solves (Session, Time, Date, \
+                                Penalty, Mix, Cube, Fingerprint) VALUES \
+                                (?, ?, ?, 0, ?, ?, ?)',
+                                (self.session, time, date,
+                                 mix, self.options.cube_type, fingerprint))
+            solve_id = self.cursor.lastrowid
+            refresh_averages(self.db_connection, self.session,
+                             (date, solve_id))
+            new_bests = update_personal_bests(self.db_connection,
+                                              self.session, (date, solve_id))
+            self.db_connection.commit()
+            if stale:
+                # The session is read again with the solve
+                self.load_saved_solves()
+            else:
+                self.pending_solves.append(solve_id)
+            self.statusBar().showMessage('Solve saved, the session is still loading')
+            self.show_new_bests(new_bests)
+            return
 
-        self.all_solves.append(time)
-        # Check if the time is a new best time
+        self.model.append(0, time, date)
         self.solves_count += 1
-        if time < self.fastest_time:
-            self.fastest_time = time
-            self.statusBar().showMessage(f'New fastest time: {self.fastest_time} seconds')
-
-        # Update the table with the new time
-        row = self.table_previous_times.rowCount()
-        self.table_previous_times.insertRow(row)
-        self.table_previous_times.setItem(row, 0, QTableWidgetItem(str(solve_id)))
-        self.table_previous_times.setItem(row, 1, QTableWidgetItem(str(time)))
-        self.table_previous_times.setItem(row, 2, QTableWidgetItem(str(date)))
-
-        averages = self.calculate_averages(5, 12)
-        ao5 = averages[5]
-        ao12 = averages[12]
-        self.last5_times.append(time)
-        self.last12_times.append(time)
-
-        if self.solves_count > 5:
-            self.last5_times.pop(0)
-            if ao5 < self.best_ao5:
-                self.best_ao5 = ao5
-                self.statusBar().showMessage(f'New best AO5: {self.best_ao5:.3f} seconds')
-        if self.solves_count > 12:
-            self.last12_times.pop(0)
-            if ao12 < self.best_ao12:
-                self.best_ao12 = ao12
-                self.statusBar().showMessage(f'New best AO12: {self.best_ao12:.3f} seconds')
+        averages = self.calculate_averages(*AVERAGE_SIZES)
+        stored = [average if average != float('inf') else None
+                  for average in averages.values()]
+
+        # Insert the time into the database
+        self.cursor.execute('INSERT INTO solves (Session, Time, Date, Penalty, \
+                            Mix, Cube, Fingerprint, avg5, avg12) VALUES \
+                            (?, ?, ?, 0, ?, ?, ?, ?, ?)',
+                            (self.session, time, date, mix,
+                             self.options.cube_type, fingerprint, *stored))
+        solve_id = self.cursor.lastrowid
+        new_bests = update_personal_bests(self.db_connection, self.session,
+                                          (date, solve_id))
+        self.db_connection.commit()
+        self.model.set_id(-1, solve_id)
+
+        self.fastest_time = min(self.fastest_time, time)
+        self.show_new_bests(new_bests)
+
+
+    def show_new_bests(self, new_bests):
+        'Announces the personal bests beaten by the last solve'
+        if new_bests:
+            self.statusBar().showMessage('New personal best: ' + ', '.join(
+                f'{PB_NAMES[size]} {result:.3f} s'
+                for size, result in new_bests.items()))
 
 
     def change_background(self):
@@ -440,19 +673,26 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.statusBar().showMessage('Focus mode activated')
         else:
             self.statusBar().showMessage('Focus mode deactivated')
+        if self.running:
+            self.show_running_time()
 
 
     def calculate_averages(self, *kwargs):
         'Calculates the averages for the last kwargs solves'
         averages = {}
         for num in kwargs:
-            times = getattr(self, f'last{num}_times', [])
-            averages[num] = np.sum(times) / len(times)
+            if len(self.solves) >= num:
+                averages[num] = trimmed_average(
+                    self.solves.effective_times(-num).tolist())
+            else:
+                averages[num] = float('inf')
         return averages
     
     
     def modify_dialog(self):
         'Opens a dialog to modify the last recorded time'
+        if self.reload_if_stale():
+            return
         dialog = ModifyDialog(self)
         dialog.exec()
 
@@ -460,45 +700,78 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def modify_time(self):
         'Modifies the last recorded time in the database'
         modification = self.sender().text()
-        last_index = self.table_previous_times.rowCount() - 1
-        # print(f'last_index: {last_index}')
-        # print(f'all solves: {self.all_solves}')
+        if self.reload_if_stale():
+            return
+        last_index = len(self.solves) - 1
 
         if last_index >= 0:
+            solve_id = self.solves.ids[last_index]
+            position = (self.solves.dates[last_index], solve_id)
             if modification == '+2':
-                self.cursor.execute('UPDATE solves SET Time = Time + 2 WHERE id = ?',
-                                    (self.table_previous_times.item(last_index, 0).text(),))
-                self.db_connection.commit()
-                self.all_solves[last_index] = round(self.all_solves[last_index] + 2, 3)
+                self.cursor.execute('UPDATE solves SET Penalty = 2000 WHERE id = ?',
+                                    (solve_id,))
+                self.model.set_penalty(last_index, PENALTY_PLUS2)
             elif modification == 'DNF':
-                self.cursor.execute('UPDATE solves SET Time = "DNF" WHERE id = ?',
-                                    (self.table_previous_times.item(last_index, 0).text(),))
-                self.db_connection.commit()
-                self.all_solves[last_index] = 'DNF'
+                self.cursor.execute('UPDATE solves SET Penalty = -1 WHERE id = ?',
+                                    (solve_id,))
+                self.model.set_penalty(last_index, PENALTY_DNF)
             elif modification == 'Remove':
                 self.cursor.execute('DELETE FROM solves WHERE id = ?',
-                                    (self.table_previous_times.item(last_index, 0).text(),))
-                self.db_connection.commit()
-                self.all_solves.pop(last_index)
+                                    (solve_id,))
+                self.model.pop(last_index)
                 self.solves_count -= 1
-                self.table_previous_times.removeRow(last_index)
+            refresh_averages(self.db_connection, self.session, position)
+            update_personal_bests(self.db_connection, self.session, position)
+            refresh_session_stats(self.db_connection)
+            self.db_connection.commit()
+            # The solves in memory are modified like the database, the
+            # session does not need to be read again
+            self.fastest_time = self.solves.best()
             self.statusBar().showMessage('Solve modified')
         else:
             self.statusBar().showMessage('No solves yet')
 
-        self.load_saved_solves()
-
 
     def options_dialog(self):
         'Opens a dialog to modify the options'
         dialog = OptionsDialog(self)
         dialog.exec()
+        self.options.scramble_length = dialog.spinBox_scramble_length.value()
+        self.options.session_cache_size = dialog.spinBox_cache_size.value()
+        self.session_cache.resize(self.options.session_cache_size)
+        self.options.timer_refresh = dialog.comboBox_timer_refresh.currentText()
+
+
+    def sessions_dialog(self):
+        'Opens a dialog with the statistics of every session'
+        dialog = SessionsDialog(self)
+        dialog.exec()
 
 
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description='Rubik\'s cube timer.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print the time of each stage of the start up.')
+    parser.add_argument('--startup-budget', type=float, metavar='SECONDS',
+                        help='Quit once loaded, with exit status 1 if the '
+                             'start up took longer than SECONDS.')
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(STARTUP_PROFILE)
+
+    def report_startup():
+        'Prints the startup profile and checks the time budget'
+        print(window.startup_profile.report(), file=sys.stderr)
+        if args.startup_budget is not None:
+            within = window.startup_profile.total <= args.startup_budget
+            print(f'Startup budget of {args.startup_budget:.3f} s '
+                  f'{"met" if within else "exceeded"}', file=sys.stderr)
+            app.exit(0 if within else 1)
+
+    if args.profile_startup or args.startup_budget is not None:
+        window.startup_finished.connect(report_startup)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Synchronizes the solves of cubestats.db between several devices.
+
+One device serves its database on the local machine or the LAN and the
+others sync with it: only the changes made since the previous sync are
+sent, in both directions.
+
+Usage:
+    python sync_solves.py serve [--host <host>] [-p <port>] [-d <database>]
+                                [-t <token>]
+    python sync_solves.py sync <host> [-p <port>] [-d <database>]
+                               [-t <token>]
+
+Arguments:
+    host: The address to listen on (127.0.0.1 by default, 0.0.0.0 for the
+          LAN) or the address of the server to sync with.
+    port: The port of the server, 8765 by default.
+    database: The database to serve or to sync, cubestats.db by default.
+    token: The secret shared by the server and the devices, the
+           CUBESTATS_SYNC_TOKEN environment variable by default. It is
+           required to serve on another address than the local machine.
+
+Example:
+    python sync_solves.py serve --host 0.0.0.0 -t <token>
+    python sync_solves.py sync 192.168.1.20 -t <token>
+"""
+
+import argparse
+import asyncio
+import os
+
+from core.database import DB_PATH, connect
+from core.sync import DEFAULT_PORT, SyncServer, sync
+
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+async def serve(database, host, port, token):
+    server = SyncServer(database, host, port, token)
+    host, port = await server.start()
+    print(f'Serving {database} on {host}:{port}')
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Synchronizes the solves of cubestats.db.')
+    parser.add_argument('command', choices=['serve', 'sync'],
+                        help='Serve the database or sync with a server.')
+    parser.add_argument('host', nargs='?', default='127.0.0.1',
+                        help='The address to listen on or of the server.')
+    parser.add_argument('--host', dest='host_option', type=str,
+                        help='The address to listen on.')
+    parser.add_argument('--port', '-p', type=int, default=DEFAULT_PORT,
+                        help='The port of the server.')
+    parser.add_argument('--database', '-d', type=str, default=DB_PATH,
+                        help='The database to serve or to sync.')
+    parser.add_argument('--token', '-t', type=str,
+                        default=os.environ.get('CUBESTATS_SYNC_TOKEN'),
+                        help='The secret shared by the server and the '
+                             'devices.')
+    args = parser.parse_args()
+    host = args.host_option or args.host
+
+    if args.command == 'serve':
+        if args.token is None and host not in LOCAL_HOSTS:
+            parser.error(f'serving on {host} requires a --token')
+        try:
+            asyncio.run(serve(args.database, host, args.port, args.token))
+        except KeyboardInterrupt:
+            pass
+    else:
+        connection = connect(args.database)
+        pushed, pulled = asyncio.run(sync(connection, host, args.port,
+                                          token=args.token))
+        connection.close()
+        print(f'{pushed} changes sent, {pulled} changes received')
@@ -0,0 +1,58 @@
+"""
+Shared fixtures and checks of the tests.
+
+The tests never touch database/cubestats.db, they work on copies of it in
+a temporary directory.
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.database import DB_PATH  # noqa: E402
+from core.stats import (PB_SIZES, backfill_averages,  # noqa: E402
+                        personal_bests, rebuild_personal_bests)
+
+
+@pytest.fixture
+def database(tmp_path):
+    'Path of a copy of the bundled database, at DB_PATH under tmp_path'
+    path = tmp_path / DB_PATH
+    path.parent.mkdir(parents=True)
+    shutil.copy(os.path.join(ROOT, DB_PATH), path)
+    return path
+
+
+def solves(connection):
+    'The solves of a device by fingerprint, with their averages'
+    return {row[0]: row[1:] for row in connection.execute(
+        'SELECT Fingerprint, Session, Time, CAST(Penalty AS INTEGER), Date, '
+        'Cube, avg5, avg12 FROM solves')}
+
+
+def leaderboards(connection):
+    'The personal bests of every session, without the ids of the device'
+    return {(session, size): [row[0] for row in
+                              personal_bests(connection, session, size)]
+            for (session,) in connection.execute(
+                'SELECT DISTINCT Session FROM solves')
+            for size in PB_SIZES}
+
+
+def assert_statistics_exact(connection):
+    'Checks the stored statistics against a full recomputation'
+    sessions = [name for (name,) in connection.execute(
+        'SELECT DISTINCT Session FROM solves')]
+    stored = solves(connection), leaderboards(connection)
+    connection.execute('UPDATE solves SET avg5 = NULL, avg12 = NULL')
+    for name in sessions:
+        backfill_averages(connection, name)
+        rebuild_personal_bests(connection, name)
+    recomputed = solves(connection), leaderboards(connection)
+    connection.rollback()
+    assert stored == recomputed
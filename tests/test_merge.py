@@ -0,0 +1,60 @@
+"""
+Merge of csTimer exports into the database.
+
+The solves of an export that are missing from the database are added with
+new ids. Existing solves keep their ids, which the running timer holds,
+even when the merged solves are older than them.
+"""
+
+import json
+
+from conftest import assert_statistics_exact
+from core.database import connect
+from csTimer2excel import csTimer2excel
+
+
+def write_export(path, session, solves):
+    'Writes a csTimer export of one session, solves are (penalty, ms, date)'
+    data = {
+        'session1': [[[penalty, milliseconds], "R U R' U'", '', timestamp]
+                     for penalty, milliseconds, timestamp in solves],
+        'properties': {
+            'sessionN': 1,
+            'sessionData': json.dumps({'1': {'name': session, 'opt': {}}}),
+        },
+    }
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def session_solves(connection, session):
+    'id: (time, penalty) of the solves of a session'
+    return {row[0]: row[1:] for row in connection.execute(
+        'SELECT id, Time, CAST(Penalty AS INTEGER) FROM solves '
+        'WHERE Session = ?', (session,))}
+
+
+def test_older_solves_keep_the_ids(database, tmp_path):
+    connection = connect(database)
+    before = session_solves(connection, 'Mayo')
+    first_date = connection.execute(
+        "SELECT MIN(Date) FROM solves WHERE Session = 'Mayo'").fetchone()[0]
+    last_id = connection.execute('SELECT MAX(id) FROM solves').fetchone()[0]
+    connection.close()
+
+    # A DNF older than every solve of the session, and a +2 in the middle
+    timestamp = first_date // 1000
+    export = write_export(tmp_path / 'export.txt', 'Mayo', [
+        (-1, 11000, timestamp - 3600), (2000, 12500, timestamp + 1)])
+    assert csTimer2excel(export).merge(database) == 2
+
+    connection = connect(database)
+    after = session_solves(connection, 'Mayo')
+    assert {solve_id: after[solve_id] for solve_id in before} == before
+    assert sorted(set(after) - set(before)) == [last_id + 1, last_id + 2]
+    ordered = [solve_id for (solve_id,) in connection.execute(
+        "SELECT id FROM solves WHERE Session = 'Mayo' ORDER BY Date, id")]
+    assert ordered[0] == last_id + 1
+    assert ordered.index(last_id + 2) == 2
+    assert_statistics_exact(connection)
+    connection.close()
@@ -0,0 +1,58 @@
+"""
+Packed scrambles of the Mix column.
+
+Every scramble of face turns up to the length limit must come back from
+encode_scrambles/decode_scrambles exactly as it went in, in one batch with
+scrambles of every length, and the values that can not be packed must be
+left as they are.
+"""
+
+import random
+
+from core.scramble import (MOVES, decode_scramble, decode_scrambles,
+                           encode_scramble, encode_scrambles)
+
+
+def random_scramble(generator, length):
+    return ' '.join(generator.choice(MOVES) for _ in range(length))
+
+
+def test_every_length_round_trips():
+    generator = random.Random(36)
+    # Lengths that are not a multiple of 3 end with a partial group, and
+    # every move is used in every position of a group
+    texts = [random_scramble(generator, length)
+             for length in range(1, 256) for _ in range(3)]
+    texts += [' '.join(MOVES), ' '.join(reversed(MOVES)), ' '.join(MOVES[:1])]
+    packed = encode_scrambles(texts)
+    for text, value in zip(texts, packed):
+        moves = len(text.split(' '))
+        assert isinstance(value, bytes)
+        assert value[0] == moves
+        assert len(value) == 1 + 2 * -(-moves // 3)
+    assert decode_scrambles(packed) == texts
+    assert [decode_scramble(encode_scramble(text))
+            for text in texts[::50]] == texts[::50]
+
+
+def test_other_values_are_kept():
+    generator = random.Random(36)
+    packed = encode_scramble("R U R' U'")
+    values = [
+        random_scramble(generator, 256),
+        "R  U R'",
+        " R U",
+        "R U ",
+        "Rw U2 R'",
+        "R U R''",
+        "R2' U",
+        "x y R",
+        '',
+        None,
+        packed,
+    ]
+    encoded = encode_scrambles(values)
+    assert encoded == values
+    assert encoded[-1] is packed
+    assert decode_scrambles(values[:-1]) == values[:-1]
+    assert decode_scrambles([packed, None, '']) == ["R U R' U'", None, '']
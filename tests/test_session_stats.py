@@ -0,0 +1,105 @@
+"""
+Statistics of the (session, cube) groups kept in session_stats.
+
+Random inserts, penalties, removals and moves are applied to a copy of the
+bundled database, and after every one of them session_stats must hold what
+a full recomputation over the solves gives. The groups marked as stale may
+hold outdated best results until refresh_session_stats recomputes them.
+"""
+
+import random
+
+import pytest
+
+from core.database import connect, solve_fingerprint
+from core.edits import apply_penalty, delete_solves, move_solves
+from core.stats import (_group_statistics, backfill_averages,
+                        refresh_session_stats)
+
+COLUMNS = ('Session, Cube, Solves, Valid, Total, Best, DateStart, DateEnd, '
+           'BestAvg5, BestAvg12')
+SESSIONS = ('Abril 2k25', 'Mayo', 'Random')
+CUBES = ('3x3', '3x3', '2x2', None)
+
+
+def groups(rows):
+    'Statistics by (session, cube), the float total compared approximately'
+    return {(row[0], row[1]): row[2:4] + (pytest.approx(row[4]),) + row[5:]
+            for row in rows}
+
+
+def assert_session_stats_exact(connection):
+    'Checks session_stats against the statistics of the whole table'
+    computed = groups(connection.execute(_group_statistics('')))
+    stored = groups(connection.execute(f'SELECT {COLUMNS} FROM session_stats'))
+    stale = {(session, cube) for session, cube in connection.execute(
+        'SELECT Session, Cube FROM session_stats WHERE Stale')}
+    assert stored.keys() == computed.keys()
+    for group, row in stored.items():
+        if group in stale:
+            # Counts, total and dates are always exact
+            assert (row[:3] + row[4:6] ==
+                    computed[group][:3] + computed[group][4:6])
+        else:
+            assert row == computed[group]
+
+
+def insert_solve(connection, generator, dates):
+    'Inserts a solve at a random date, as an import or a sync does'
+    session = generator.choice(SESSIONS)
+    date = generator.randint(*dates)
+    milliseconds = generator.randint(3000, 30000)
+    cursor = connection.execute(
+        'INSERT INTO solves (Session, Date, Time, Penalty, Cube, Fingerprint) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (session, date, milliseconds / 1000,
+         generator.choice((0, 0, 0, 2000, -1)), generator.choice(CUBES),
+         solve_fingerprint(date // 1000, milliseconds, '')))
+    connection.execute('INSERT OR IGNORE INTO sessions(name) VALUES (?)',
+                       (session,))
+    backfill_averages(connection, session, start=(date, cursor.lastrowid))
+    connection.commit()
+
+
+def remove_solve(connection, solve_id):
+    'Removes a solve without refreshing the stale groups'
+    session, date = connection.execute(
+        'SELECT Session, Date FROM solves WHERE id = ?', (solve_id,)).fetchone()
+    connection.execute('DELETE FROM solves WHERE id = ?', (solve_id,))
+    backfill_averages(connection, session, start=(date, solve_id))
+    connection.commit()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_edits_keep_session_stats_exact(database, seed):
+    generator = random.Random(seed)
+    connection = connect(database)
+    dates = connection.execute(
+        'SELECT MIN(Date) - 86400000, MAX(Date) + 86400000 '
+        'FROM solves').fetchone()
+    assert_session_stats_exact(connection)
+
+    for _ in range(150):
+        ids = [solve_id for (solve_id,) in connection.execute(
+            'SELECT id FROM solves')]
+        some = generator.sample(ids, min(len(ids), generator.randint(1, 6)))
+        operation = generator.choice(
+            ('insert', 'insert', 'penalty', 'delete', 'move', 'remove'))
+        if operation == 'insert' or len(ids) < 10:
+            insert_solve(connection, generator, dates)
+        elif operation == 'penalty':
+            apply_penalty(connection, some, generator.choice((0, 2000, -1)))
+        elif operation == 'delete':
+            delete_solves(connection, some)
+        elif operation == 'move':
+            move_solves(connection, some, generator.choice(SESSIONS))
+        else:
+            remove_solve(connection, some[0])
+        assert_session_stats_exact(connection)
+
+    refresh_session_stats(connection)
+    connection.commit()
+    assert connection.execute(
+        'SELECT COUNT(*) FROM session_stats WHERE Stale').fetchone()[0] == 0
+    assert_session_stats_exact(connection)
+    connection.close()
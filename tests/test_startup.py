@@ -0,0 +1,79 @@
+"""
+Start up time of the timer.
+
+main.py is run with --startup-budget under the offscreen Qt platform, in a
+temporary directory holding a copy of the database, and the time at which
+the window is fully loaded is checked against the budget.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+pytest.importorskip('PyQt6')
+
+from core.database import connect, solve_fingerprint  # noqa: E402
+from core.stats import backfill_averages, rebuild_personal_bests  # noqa: E402
+
+# Seconds from the start of the process to the fully loaded window
+STARTUP_BUDGET = 2.0
+
+
+def run_timer(database, budget):
+    """
+    Runs the timer on a database placed at DB_PATH and returns its exit
+    status and the stages of its startup profile, {name: milliseconds}
+    """
+    environment = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    process = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'main.py'),
+         '--startup-budget', str(budget)],
+        cwd=database.parent.parent, env=environment, capture_output=True,
+        text=True, timeout=60)
+    stages = {name: float(milliseconds) for name, milliseconds in
+              re.findall(r'^\s+(\w[\w ]*?)\s+([\d.]+) ms', process.stderr,
+                         re.MULTILINE)}
+    return process.returncode, stages
+
+
+def test_startup_within_budget(database):
+    status, stages = run_timer(database, STARTUP_BUDGET)
+    assert 'fully loaded' in stages
+    assert stages['fully loaded'] <= STARTUP_BUDGET * 1000
+    assert status == 0
+
+
+def test_startup_with_a_large_session(database):
+    # 50000 solves, all of them in the session opened at start up
+    connection = connect(database)
+    session = connection.execute(
+        'SELECT name FROM sessions LIMIT 1').fetchone()[0]
+    start = connection.execute('SELECT MAX(Date) FROM solves').fetchone()[0]
+    solves = []
+    for i in range(50000):
+        date = start + (i + 1) * 30000
+        milliseconds = 10000 + i % 5000
+        solves.append((session, date, milliseconds / 1000, 0, '3x3',
+                       solve_fingerprint(date // 1000, milliseconds, '')))
+    connection.executemany(
+        'INSERT INTO solves (Session, Date, Time, Penalty, Cube, Fingerprint) '
+        'VALUES (?, ?, ?, ?, ?, ?)', solves)
+    backfill_averages(connection, session)
+    rebuild_personal_bests(connection, session)
+    connection.commit()
+    connection.close()
+
+    status, stages = run_timer(database, STARTUP_BUDGET)
+    assert stages['fully loaded'] <= STARTUP_BUDGET * 1000
+    assert status == 0
+
+
+def test_startup_over_budget_fails(database):
+    status, stages = run_timer(database, 0.001)
+    assert 'fully loaded' in stages
+    assert status == 1
@@ -0,0 +1,214 @@
+"""
+Replication of the solves between two devices.
+
+A SyncServer on a copy of the bundled database runs in the test process on
+a free port, and a second database syncs with it. After every sync both
+devices must have the same solves, and their stored averages and personal
+bests must be the ones a full recomputation gives.
+"""
+
+import asyncio
+import sqlite3
+import zlib
+
+import pytest
+
+from conftest import assert_statistics_exact, leaderboards, solves
+from core.database import connect, solve_fingerprint
+from core.edits import apply_penalty, delete_solves, move_solves
+from core.stats import backfill_averages, update_personal_bests
+from core.sync import (MAX_FRAME_SIZE, MAX_MESSAGE_SIZE, SyncError,
+                       SyncServer, _HEADER, read_frame, sync)
+
+
+def run_with_server(database, scenario, token=None):
+    'Runs scenario(server, host, port) with a server on database'
+    async def main():
+        server = SyncServer(database, port=0, token=token)
+        host, port = await server.start()
+        try:
+            return await scenario(server, host, port)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+def add_solve(connection, session, date, time):
+    'Records a solve like the timer does, returns its id'
+    cursor = connection.execute(
+        'INSERT INTO solves (Session, Date, Time, Penalty, Cube, Fingerprint) '
+        'VALUES (?, ?, ?, 0, ?, ?)',
+        (session, date, time, '3x3',
+         solve_fingerprint(date // 1000, round(time * 1000), '')))
+    solve_id = cursor.lastrowid
+    backfill_averages(connection, session, start=(date, solve_id))
+    update_personal_bests(connection, session, (date, solve_id))
+    connection.commit()
+    return solve_id
+
+
+def session_ids(connection, session):
+    return [solve_id for (solve_id,) in connection.execute(
+        'SELECT id FROM solves WHERE Session = ? ORDER BY Date, id',
+        (session,))]
+
+
+def fingerprint_ids(connection):
+    return dict(connection.execute('SELECT Fingerprint, id FROM solves'))
+
+
+@pytest.fixture
+def client(tmp_path):
+    'An empty database on another device'
+    connection = connect(tmp_path / 'client.db')
+    yield connection
+    connection.close()
+
+
+def test_first_sync_copies_every_solve(database, client):
+    async def scenario(server, host, port):
+        pushed, pulled = await sync(client, host, port, batch_size=7)
+        assert pushed == 0
+        assert pulled == len(solves(server.connection))
+        assert solves(client) == solves(server.connection)
+        assert leaderboards(client) == leaderboards(server.connection)
+        assert await sync(client, host, port) == (0, 0)
+
+    run_with_server(database, scenario)
+    assert_statistics_exact(client)
+
+
+def test_edits_travel_both_ways(database, client):
+    async def scenario(server, host, port):
+        await sync(client, host, port)
+        session = client.execute(
+            'SELECT name FROM sessions LIMIT 1').fetchone()[0]
+        ids = session_ids(client, session)
+        apply_penalty(client, ids[:3], -1)
+        apply_penalty(client, ids[3:4], 2000)
+        delete_solves(client, ids[4:6])
+        move_solves(client, ids[6:9], 'Moved')
+        date = client.execute('SELECT MAX(Date) FROM solves').fetchone()[0]
+        add_solve(client, session, date + 60000, 9.5)
+
+        other = server.connection.execute(
+            'SELECT Session FROM solves WHERE Session != ? LIMIT 1',
+            (session,)).fetchone()[0]
+        server_ids = session_ids(server.connection, other)
+        apply_penalty(server.connection, server_ids[-2:], -1)
+        delete_solves(server.connection, server_ids[:1])
+
+        await sync(client, host, port)
+        assert solves(client) == solves(server.connection)
+        assert leaderboards(client) == leaderboards(server.connection)
+        assert_statistics_exact(server.connection)
+
+    run_with_server(database, scenario)
+    assert_statistics_exact(client)
+
+
+def test_older_solves_are_synced_in_date_order(database, client):
+    async def scenario(server, host, port):
+        await sync(client, host, port)
+        session = client.execute(
+            'SELECT name FROM sessions LIMIT 1').fetchone()[0]
+        date = client.execute('SELECT MIN(Date) FROM solves WHERE Session = ?',
+                              (session,)).fetchone()[0]
+        # Solves of the server older than the ones of the client
+        for i in range(6):
+            add_solve(server.connection, session, date - (i + 1) * 60000,
+                      8.0 + i)
+        add_solve(client, session, date + 30000, 7.5)
+        client_ids = fingerprint_ids(client)
+        server_ids = fingerprint_ids(server.connection)
+
+        await sync(client, host, port)
+        assert solves(client) == solves(server.connection)
+        # The synced solves get new ids, the existing ones keep theirs
+        assert fingerprint_ids(client).items() >= client_ids.items()
+        assert fingerprint_ids(server.connection).items() >= server_ids.items()
+        assert_statistics_exact(server.connection)
+
+    run_with_server(database, scenario)
+    assert_statistics_exact(client)
+
+
+def test_pulled_changes_stay_in_the_log(database, client):
+    async def scenario(server, host, port):
+        peer = f'{host}:{port}'
+        _, pulled = await sync(client, host, port)
+        origins = client.execute(
+            'SELECT Origin, COUNT(*) FROM changes GROUP BY Origin').fetchall()
+        assert origins == [(peer, pulled)]
+
+        # Only the local change is pushed, the server sends it back
+        solve_id = session_ids(client, 'Mayo')[0]
+        apply_penalty(client, [solve_id], 2000)
+        assert await sync(client, host, port) == (1, 1)
+        assert client.execute(
+            'SELECT Origin, COUNT(*) FROM changes GROUP BY Origin '
+            'ORDER BY Origin').fetchall() == [(None, 1), (peer, pulled)]
+        assert server.connection.execute(
+            "SELECT Origin FROM changes WHERE Op = 'penalty'").fetchall() == [
+                (host,)]
+        assert await sync(client, host, port) == (0, 0)
+
+    run_with_server(database, scenario)
+
+
+def test_server_with_a_token(database, client):
+    async def scenario(server, host, port):
+        for token in (None, 'wrong'):
+            with pytest.raises(SyncError, match='Invalid token'):
+                await sync(client, host, port, token=token)
+        assert client.execute('SELECT COUNT(*) FROM solves').fetchone()[0] == 0
+        _, pulled = await sync(client, host, port, token='secret')
+        assert pulled == len(solves(server.connection))
+
+    run_with_server(database, scenario, token='secret')
+
+
+BOMB = zlib.compress(b' ' * (MAX_MESSAGE_SIZE + 1))
+
+
+@pytest.mark.parametrize('frame, error', [
+    # Announces more than the frame limit
+    (_HEADER.pack(MAX_FRAME_SIZE + 1), 'too large'),
+    # A few KiB that expand past the message limit
+    (_HEADER.pack(len(BOMB)) + BOMB, 'Message larger'),
+    # Data after the compressed message
+    (_HEADER.pack(len(zlib.compress(b'{}')) + 1) + zlib.compress(b'{}') + b'x',
+     'Invalid frame'),
+], ids=['too large', 'bomb', 'trailing data'])
+def test_invalid_frames_are_rejected(database, frame, error):
+    async def scenario(server, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(frame)
+        await writer.drain()
+        answer = await read_frame(reader)
+        writer.close()
+        await writer.wait_closed()
+        return answer
+
+    # Rejected before the token is checked
+    answer = run_with_server(database, scenario, token='secret')
+    assert error in answer['error']
+
+
+def test_push_to_a_locked_database(database, client):
+    async def scenario(server, host, port):
+        await sync(client, host, port)
+        apply_penalty(client, session_ids(client, 'Mayo')[:1], 2000)
+        server.connection.execute('PRAGMA busy_timeout = 100')
+        writer = sqlite3.connect(database)
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            with pytest.raises(SyncError, match='locked'):
+                await sync(client, host, port)
+        finally:
+            writer.rollback()
+            writer.close()
+        # The change is pushed again once the database is free
+        assert await sync(client, host, port) == (1, 1)
+
+    run_with_server(database, scenario)